@@ -1,42 +1,68 @@
 # stage0_convert.py
-import json
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from tqdm import tqdm
 
+# orjson is a much faster C parser; fall back to the stdlib if it isn't installed.
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.loads
+
+def _convert_one(path_pair):
+    """
+    Worker: converts a single JSON file to TXT.
+    Returns (filename, error) so the parent can report failures in order.
+    """
+    json_path, txt_path = path_pair
+    filename = os.path.basename(json_path)
+    try:
+        # Read raw bytes; both parsers decode UTF-8 themselves.
+        data = _loads(Path(json_path).read_bytes())
+
+        # This assumes the JSON is a list of strings.
+        # If structure is different, this is where you'd change the logic.
+        if isinstance(data, list):
+            text_content = "\n\n".join(str(item) for item in data)
+        else:
+            # Handle other potential JSON structures if necessary
+            text_content = str(data)
+
+        Path(txt_path).write_text(text_content, encoding="utf-8")
+        return filename, None
+    except Exception as e:
+        return filename, e
+
 def convert_json_to_txt(input_dir, output_dir):
     os.makedirs(output_dir, exist_ok=True)
-    filenames = [f for f in os.listdir(input_dir) if f.endswith(".json")]
+    filenames = [e.name for e in os.scandir(input_dir) if e.is_file() and e.name.endswith(".json")]
 
     if not filenames:
         print(f"No .json files found in {input_dir}")
         return
 
+    pairs = [
+        (os.path.join(input_dir, filename), os.path.join(output_dir, filename.replace(".json", ".txt")))
+        for filename in filenames
+    ]
+
     print(f"Found {len(filenames)} files to convert.")
-    for filename in tqdm(filenames, desc="Converting JSON to TXT"):
-        json_path = os.path.join(input_dir, filename)
-        txt_path = os.path.join(output_dir, filename.replace(".json", ".txt"))
-
-        try:
-            with open(json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            # This assumes the JSON is a list of strings.
-            # If structure is different, this is where you'd change the logic.
-            if isinstance(data, list):
-                text_content = "\n\n".join(str(item) for item in data)
-            else:
-                # Handle other potential JSON structures if necessary
-                text_content = str(data)
-            
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(text_content)
-        except Exception as e:
-            print(f"\nError processing {filename}: {e}")
+    # Files are independent, so spread the JSON decoding across all cores.
+    # chunksize amortizes the inter-process overhead for many small files.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        results = list(tqdm(ex.map(_convert_one, pairs, chunksize=8), total=len(pairs), desc="Converting JSON to TXT"))
+
+    for filename, err in results:
+        if err is not None:
+            print(f"\nError processing {filename}: {err}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert JSON files (list of strings) to TXT.")
     parser.add_argument("input_dir", help="Directory containing raw .json files.")
     parser.add_argument("output_dir", help="Directory to save converted .txt files.")
     args = parser.parse_args()
-    convert_json_to_txt(args.input_dir, args.output_dir)
\ No newline at end of file
+    convert_json_to_txt(args.input_dir, args.output_dir)
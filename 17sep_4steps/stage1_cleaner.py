@@ -3,8 +3,17 @@
 import os
 import re
 import argparse
+from pathlib import Path
 from tqdm import tqdm
 
+# RE2 scans in guaranteed linear time, but has no backreferences or lookarounds, and its
+# \d, \s and \b only know ASCII. Patterns that rely on any of those stay on the stdlib `re`
+# so the output doesn't depend on whether RE2 is installed; the rest use RE2 when available.
+try:
+    import re2
+except ImportError:
+    re2 = re
+
 # --- CUSTOMIZED & COMPILED REGEX PATTERNS (CORRECTED) ---
 
 # Matches common academic headers/footers, now customized for your specific document.
@@ -31,23 +40,70 @@ HEADER_FOOTER_PATTERNS = re.compile(
 DUPLICATE_PHRASE_PATTERN = re.compile(r'\b(.+?)\b\s+\1\b')
 
 # New pattern to remove any remaining inline footnote markers
-INLINE_FOOTNOTE_PATTERN = re.compile(r'[①]')
+INLINE_FOOTNOTE_PATTERN = r'[①]'
 
 # Matches a word split by a hyphen at the end of a line. e.g., "experi-\nment"
-DEHYPHENATE_PATTERN = re.compile(r'([a-zA-Z])-\n([a-zA-Z])')
+# Footnote markers around the break (e.g. "experi-①\nment") are dropped with it,
+# as if they had been removed before the join.
+DEHYPHENATE_PATTERN = (
+    rf'(?P<h1>[a-zA-Z]){INLINE_FOOTNOTE_PATTERN}*-{INLINE_FOOTNOTE_PATTERN}*\n'
+    rf'{INLINE_FOOTNOTE_PATTERN}*(?P<h2>[a-zA-Z])'
+)
 
-# Matches and removes line numbers at the start of a line (e.g., "12 | text...")
-LINE_NUMBER_PATTERN = re.compile(r'^\s*\d+\s*\|?\s*')
+# Matches and removes line numbers at the start of the text (e.g., "12 | text...").
+# Not part of the fused pass: a number can become leading only once a footnote marker before it is gone.
+LINE_NUMBER_PATTERN = re.compile(r'\A\s*\d+\s*\|?\s*')
+
+# Footnote and de-hyphenation patterns fused into one alternation,
+# so the text is scanned once instead of twice.
+# Headers and duplicated phrases are removed before it, in their own passes, since each
+# changes what the passes after it see.
+MEGA_PATTERN = re.compile(
+    f'(?P<cite>{INLINE_FOOTNOTE_PATTERN})|'
+    f'(?P<hyphen>{DEHYPHENATE_PATTERN})'
+)
 
 # Matches potential list item markers (e.g., a., b., 1., i.) to prevent incorrect joining
-LIST_ITEM_PATTERN = re.compile(r'^\s*(\([a-zA-Z0-9]+\)|[a-zA-Z0-9]\.|[•●*–-]\s)')
+LIST_ITEM_PATTERN = r'(?:\([a-zA-Z0-9]+\)|[a-zA-Z0-9]\.|[•●*–-][^\S\n])'
 
 # Matches common figure/table captions to isolate them
-CAPTION_PATTERN = re.compile(r'^(Fig(ure)?\.? \d+|Table \d+)\b.*$', re.IGNORECASE | re.MULTILINE)
+CAPTION_PATTERN = r'(?i:Fig(?:ure)?\.? \d+|Table \d+)\b'
+
+# Characters that mark a line as a "complete thought"
+SENTENCE_END_CHARS = '.?!"”:'
+
+# Strips leading/trailing whitespace from every line (stdlib re, to match str.strip on Unicode spaces)
+LINE_STRIP_PATTERN = re.compile(r'^[^\S\n]+|[^\S\n]+$', re.MULTILINE)
+
+# Matches a run of lines that form one paragraph, starting from a line that is not a list item or
+# caption: every line that doesn't end a sentence absorbs the next non-empty, non-list line.
+# A bare bullet or a caption label split from its number (e.g. "Fig" / "3 ...") becomes a list item
+# or caption once merged, which ends the run after that single merge.
+# Uses lookaheads, which RE2 does not support, so it stays on the stdlib re.
+SPLIT_MARKER_PATTERN = r'(?:[•●*–-]|(?i:Fig(?:ure)?|Table)(?=\n\d+\b))'
+JOIN_PATTERN = re.compile(
+    rf'^(?!{LIST_ITEM_PATTERN})(?!{CAPTION_PATTERN})'
+    rf'(?:{SPLIT_MARKER_PATTERN}\n(?=[^\n])(?!{LIST_ITEM_PATTERN})'
+    rf'|(?:[^\n]*[^\n{SENTENCE_END_CHARS}]\n(?=[^\n])(?!{LIST_ITEM_PATTERN}))+)'
+    r'[^\n]*',
+    re.MULTILINE
+)
 
 # Normalization for whitespace
-MULTI_WHITESPACE_PATTERN = re.compile(r'[ \t]+')
-MULTI_NEWLINE_PATTERN = re.compile(r'\n{3,}')
+# Runs of spaces/tabs collapse to one space and 3+ newlines to a paragraph break, in one pass.
+NORMALIZE_PATTERN = re2.compile(r'[ \t]+|\n{3,}')
+
+
+def _normalize_dispatch(match: re.Match) -> str:
+    """Replacement callback for NORMALIZE_PATTERN."""
+    return '\n\n' if match.group(0)[0] == '\n' else ' '
+
+
+def _mega_dispatch(match: re.Match) -> str:
+    """Replacement callback for MEGA_PATTERN: drops everything except de-hyphenated words."""
+    if match.lastgroup == 'hyphen':
+        return match.group('h1') + match.group('h2')
+    return ''
 
 
 def clean_academic_text(text: str) -> str:
@@ -61,44 +117,19 @@ def clean_academic_text(text: str) -> str:
     # 2. Fix duplicated phrases (e.g., "Foreword Foreword" -> "Foreword").
     cleaned_text = DUPLICATE_PHRASE_PATTERN.sub(r'\1', cleaned_text)
 
-    # 3. Remove any remaining inline footnote markers.
-    cleaned_text = INLINE_FOOTNOTE_PATTERN.sub('', cleaned_text)
+    # 3. In a single pass: remove inline footnote markers and re-join hyphenated words.
+    cleaned_text = MEGA_PATTERN.sub(_mega_dispatch, cleaned_text)
 
-    # 4. Remove line numbers from the start of lines.
+    # 4. Remove line numbers from the start of the text (anchored, so this is nearly free).
+    # Only letters are joined in step 3, so it doesn't matter that this runs after it.
     cleaned_text = LINE_NUMBER_PATTERN.sub('', cleaned_text)
-
-    # 5. Re-join words that were hyphenated across lines.
-    cleaned_text = DEHYPHENATE_PATTERN.sub(r'\1\2', cleaned_text)
     
-    # 6. Join broken sentences and paragraphs (procedural step).
-    lines = cleaned_text.split('\n')
-    rejoined_lines = []
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if not line:
-            rejoined_lines.append('') # Preserve paragraph breaks
-            i += 1
-            continue
-
-        is_complete_thought = line.endswith(('.', '?', '!', '"', '”', ':')) or \
-                              LIST_ITEM_PATTERN.match(line) or \
-                              CAPTION_PATTERN.match(line)
-        
-        if not is_complete_thought and (i + 1) < len(lines):
-            next_line = lines[i+1].strip()
-            if next_line and not LIST_ITEM_PATTERN.match(next_line):
-                lines[i+1] = line + ' ' + next_line
-            else:
-                rejoined_lines.append(line)
-        else:
-            rejoined_lines.append(line)
-        i += 1
-    cleaned_text = '\n'.join(rejoined_lines)
-
-    # 7. Normalize whitespace.
-    cleaned_text = MULTI_WHITESPACE_PATTERN.sub(' ', cleaned_text)
-    cleaned_text = MULTI_NEWLINE_PATTERN.sub('\n\n', cleaned_text)
+    # 5. Join broken sentences and paragraphs.
+    cleaned_text = LINE_STRIP_PATTERN.sub('', cleaned_text)
+    cleaned_text = JOIN_PATTERN.sub(lambda m: m.group(0).replace('\n', ' '), cleaned_text)
+
+    # 6. Normalize whitespace.
+    cleaned_text = NORMALIZE_PATTERN.sub(_normalize_dispatch, cleaned_text)
     
     return cleaned_text.strip()
 
@@ -113,7 +144,7 @@ def process_directory(input_dir: str, output_dir: str):
 
     os.makedirs(output_dir, exist_ok=True)
     
-    filenames = sorted([f for f in os.listdir(input_dir) if f.endswith(".txt")])
+    filenames = sorted(e.name for e in os.scandir(input_dir) if e.is_file() and e.name.endswith(".txt"))
     
     if not filenames:
         print(f"No .txt files found in {input_dir}")
@@ -126,13 +157,11 @@ def process_directory(input_dir: str, output_dir: str):
         output_path = os.path.join(output_dir, filename)
         
         try:
-            with open(input_path, 'r', encoding='utf-8') as f:
-                raw_text = f.read()
+            raw_text = Path(input_path).read_text(encoding='utf-8')
             
             cleaned_text = clean_academic_text(raw_text)
             
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(cleaned_text)
+            Path(output_path).write_text(cleaned_text, encoding='utf-8')
         except Exception as e:
             print(f"\nCould not process {filename}. Error: {e}")
 
@@ -3,7 +3,12 @@
 import os
 import ollama
 import json
+import hashlib
+import sqlite3
+import threading
 import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import traceback
 
@@ -15,10 +20,24 @@ SCORE_THRESHOLD = 7              # Chunks scoring below this will be sent for re
 CHUNK_SIZE = 5                   # Number of paragraphs per chunk.
 CHUNK_OVERLAP = 1                # Number of paragraphs to overlap between chunks.
 
+# Greedy, short decoding for the classifier: it only has to emit a ~30 token JSON object.
+# num_ctx bounds the KV cache; 4096 leaves room for the prompt plus a 5-paragraph chunk.
+CLASSIFIER_OPTIONS = {'temperature': 0.0, 'top_k': 1, 'num_predict': 80, 'num_ctx': 4096}
+REPAIR_TEMPERATURE = 0.1
+# Single-turn prompts go through /api/generate; keep the model loaded between chunks and files.
+KEEP_ALIVE = '1h'
+# In-flight requests to the Ollama server. Match the server's OLLAMA_NUM_PARALLEL setting.
+MAX_CONCURRENT_REQUESTS = 4
+# On-disk cache of LLM verdicts and repairs, so overlapping chunks and re-runs skip the LLM.
+CACHE_PATH = os.path.expanduser("~/.cache/stage3_llm.db")
+OUTPUT_BUFFER_SIZE = 128 * 1024  # Write buffer for the streamed output files.
+
 # --- PROMPT ENGINEERING (CORRECTED) ---
 
-# The curly braces in the example JSON are now escaped by doubling them up ({{ and }})
-CLASSIFIER_PROMPT_TEMPLATE = """
+# The classifier instructions are static and sent as the system prompt, so the server can reuse
+# the KV cache for this prefix across calls; only the user prompt changes per chunk.
+# The system prompt is never .format()-ed, so its example JSON uses single braces.
+CLASSIFIER_SYSTEM_PROMPT = """
 You are a meticulous text quality analyst. Your task is to evaluate a text segment for signs of poor PDF-to-text conversion.
 Analyze the following text for structural errors like incorrectly broken sentences, merged paragraphs, or nonsensical line breaks.
 Do not evaluate the factual content. Focus ONLY on structure, grammar, and logical flow.
@@ -36,14 +55,16 @@ The "score" key is mandatory and must always be present.
 
 <example_good>
 Text: "The study concluded that further research was necessary. Participants were recruited from a local university."
-JSON: {{"score": 10, "reason": "The text is well-structured with complete sentences."}}
+JSON: {"score": 10, "reason": "The text is well-structured with complete sentences."}
 </example_good>
 
 <example_bad>
 Text: "The study concluded that further. Research was necessary participants were recruited from a local university."
-JSON: {{"score": 3, "reason": "A sentence is incorrectly broken after 'further' and improperly merged with the next thought."}}
+JSON: {"score": 3, "reason": "A sentence is incorrectly broken after 'further' and improperly merged with the next thought."}
 </example_bad>
+"""
 
+CLASSIFIER_USER_TEMPLATE = """
 Now, evaluate this text:
 <text_to_analyze>
 {text_chunk}
@@ -73,20 +94,58 @@ Your task is to fix ONLY the identified problem and return the corrected text.
 **Corrected Text:**
 """
 
+# --- LLM RESULT CACHE ---
+_cache_lock = threading.Lock()
+_cache_conn = None
+
+def _cache_key(*parts: str) -> str:
+    """Builds a cache key from the model name and the given strings."""
+    data = "\x00".join((MODEL_NAME,) + parts).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _get_cache() -> sqlite3.Connection:
+    """Opens the cache database on first use. Callers must hold _cache_lock."""
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        _cache_conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return _cache_conn
+
+def cache_get(key: str):
+    """Returns the cached JSON value for key, or None."""
+    with _cache_lock:
+        row = _get_cache().execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def cache_put(key: str, value) -> None:
+    """Stores a JSON-serializable value under key."""
+    with _cache_lock:
+        conn = _get_cache()
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        conn.commit()
+
 def classify_chunk(client: ollama.Client, text_chunk: str) -> dict:
     """
     "Bulletproof" version: Uses the LLM to score a text chunk and gracefully
     handles any malformed or incomplete response from the LLM.
     """
-    # This line will now execute correctly.
-    prompt = CLASSIFIER_PROMPT_TEMPLATE.format(text_chunk=text_chunk)
+    key = _cache_key("classify", text_chunk)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
+    prompt = CLASSIFIER_USER_TEMPLATE.format(text_chunk=text_chunk)
     try:
-        response = client.chat(
+        response = client.generate(
             model=MODEL_NAME,
-            messages=[{'role': 'user', 'content': prompt}],
-            format='json'
+            system=CLASSIFIER_SYSTEM_PROMPT,
+            prompt=prompt,
+            format='json',
+            options=CLASSIFIER_OPTIONS,
+            keep_alive=KEEP_ALIVE
         )
-        result = json.loads(response['message']['content'])
+        result = json.loads(response['response'])
         
         score = result.get('score')
         reason = result.get('reason')
@@ -94,7 +153,9 @@ def classify_chunk(client: ollama.Client, text_chunk: str) -> dict:
         if score is not None and reason is not None:
             try:
                 score_value = int(score)
-                return {"score": score_value, "reason": str(reason)}
+                result = {"score": score_value, "reason": str(reason)}
+                cache_put(key, result)
+                return result
             except (ValueError, TypeError):
                 print(f"Debug: LLM returned non-integer score: '{score}'. Defaulting to 1.")
                 return {"score": 1, "reason": f"LLM returned non-integer score: '{score}'"}
@@ -108,21 +169,41 @@ def classify_chunk(client: ollama.Client, text_chunk: str) -> dict:
 
 def repair_chunk(client: ollama.Client, text_chunk: str, reason: str) -> str:
     """Uses the LLM to repair a text chunk."""
+    key = _cache_key("repair", text_chunk, reason)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
     prompt = REPAIR_PROMPT_TEMPLATE.format(text_chunk=text_chunk, reason=reason)
     try:
-        response = client.chat(
+        response = client.generate(
             model=MODEL_NAME,
-            messages=[{'role': 'user', 'content': prompt}]
+            prompt=prompt,
+            # Cap the output near the input length (Chinese is roughly one token per character).
+            options={'temperature': REPAIR_TEMPERATURE, 'num_predict': max(256, len(text_chunk))},
+            keep_alive=KEEP_ALIVE
         )
-        return response['message']['content'].strip()
+        repaired = response['response'].strip()
+        cache_put(key, repaired)
+        return repaired
     except Exception as e:
         print(f"  - Repair failed for chunk: {e}. Returning original.")
         return text_chunk
 
-def process_file(client: ollama.Client, file_path: str) -> str:
-    """Reads, chunks, classifies, repairs, and reassembles a single file."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        text = f.read()
+def warm_up_model(client: ollama.Client):
+    """Loads the model into memory before the first chunk, so no request pays the cold start."""
+    try:
+        # A generate request with an empty prompt only loads the model.
+        client.generate(model=MODEL_NAME, prompt='', keep_alive=KEEP_ALIVE)
+    except Exception as e:
+        print(f"  - Model warm-up failed: {e}. Continuing anyway.")
+
+def process_file(client: ollama.Client, file_path: str) -> list:
+    """
+    Reads, chunks, classifies, repairs, and reassembles a single file.
+    Returns the final, de-duplicated paragraphs in order.
+    """
+    text = Path(file_path).read_text(encoding='utf-8')
 
     paragraphs = text.split('\n\n')
     if len(paragraphs) <= CHUNK_SIZE:
@@ -133,30 +214,42 @@ def process_file(client: ollama.Client, file_path: str) -> str:
             chunk = "\n\n".join(paragraphs[i:i + CHUNK_SIZE])
             chunks.append(chunk)
 
-    repaired_chunks = []
     print(f"\nProcessing {os.path.basename(file_path)} in {len(chunks)} chunks...")
-    
-    for chunk in tqdm(chunks, desc="  - Analyzing chunks", leave=False):
-        classification = classify_chunk(client, chunk)
-        score = classification.get('score', 1)
-        reason = classification.get('reason', 'Unknown error')
-        
-        if score < SCORE_THRESHOLD:
-            repaired_chunk = repair_chunk(client, chunk, reason)
-            repaired_chunks.append(repaired_chunk)
-        else:
-            repaired_chunks.append(chunk)
 
-    full_text = "\n\n".join(repaired_chunks)
+    # The LLM calls are I/O-bound HTTP requests, so keep several in flight at once.
+    # executor.map preserves the chunk order.
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        classifications = list(tqdm(
+            executor.map(lambda c: classify_chunk(client, c), chunks),
+            total=len(chunks), desc="  - Analyzing chunks", leave=False
+        ))
+
+        failing = [
+            (i, classification.get('reason', 'Unknown error'))
+            for i, classification in enumerate(classifications)
+            if classification.get('score', 1) < SCORE_THRESHOLD
+        ]
+        repairs = executor.map(lambda item: repair_chunk(client, chunks[item[0]], item[1]), failing)
+
+        repaired_chunks = list(chunks)
+        for (i, _), repaired_chunk in zip(failing, repairs):
+            repaired_chunks[i] = repaired_chunk
+
+    # Drop the paragraphs duplicated by the chunk overlap. Only 16-byte digests are kept
+    # in the set, rather than the paragraphs themselves.
     final_paragraphs = []
-    seen_paragraphs = set()
-    for para in full_text.split('\n\n'):
-        para_strip = para.strip()
-        if para_strip and para_strip not in seen_paragraphs:
-            final_paragraphs.append(para.strip())
-            seen_paragraphs.add(para_strip)
-            
-    return "\n\n".join(final_paragraphs)
+    seen_digests = set()
+    for chunk in repaired_chunks:
+        for para in chunk.split('\n\n'):
+            para_strip = para.strip()
+            if not para_strip:
+                continue
+            digest = hashlib.blake2b(para_strip.encode('utf-8'), digest_size=16).digest()
+            if digest not in seen_digests:
+                seen_digests.add(digest)
+                final_paragraphs.append(para_strip)
+
+    return final_paragraphs
 
 def process_directory(input_dir: str, output_dir: str):
     """Processes all .txt files from the Stage 2 output directory."""
@@ -166,22 +259,27 @@ def process_directory(input_dir: str, output_dir: str):
 
     os.makedirs(output_dir, exist_ok=True)
     
-    filenames = sorted([f for f in os.listdir(input_dir) if f.endswith(".txt")])
+    filenames = sorted(e.name for e in os.scandir(input_dir) if e.is_file() and e.name.endswith(".txt"))
     if not filenames:
         print(f"No .txt files found in {input_dir}")
         return
 
     client = ollama.Client()
     print(f"Starting Stage 3 LLM refinement with model: {MODEL_NAME}")
+    warm_up_model(client)
 
     for filename in filenames:
         input_path = os.path.join(input_dir, filename)
         output_path = os.path.join(output_dir, filename)
         
         try:
-            final_text = process_file(client, input_path)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(final_text)
+            final_paragraphs = process_file(client, input_path)
+            # Write paragraph by paragraph instead of building one large string.
+            with open(output_path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+                for i, para in enumerate(final_paragraphs):
+                    if i:
+                        f.write('\n\n')
+                    f.write(para)
         except Exception as e:
             print(f"\n--- FATAL ERROR PROCESSING {filename} ---")
             print(f"An unexpected error occurred: {e}")
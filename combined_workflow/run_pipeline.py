@@ -0,0 +1,167 @@
+# python run_pipeline.py ./source_docs ./results/step5_final [--checkpoint ./results]
+
+import os
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+import ollama
+from tqdm import tqdm
+
+from step1_ingest import find_supported_files, extract_text_from_file
+from step2_rule_clean import clean_text_with_rules
+import step3_sentence_parser as step3
+import step4_llm_prune as step4
+import step5_llm_refine as step5
+
+# Sub-directories of --checkpoint for each intermediate step, named as in run_pipeline.sh.
+CHECKPOINT_DIRS = {
+    1: "step1_ingested",
+    2: "step2_rule_cleaned",
+    3: "step3_parsed",
+    4: "step4_pruned",
+}
+
+def write_checkpoint(checkpoint_dir: str, step: int, name: str, text: str):
+    """Saves one document's intermediate text, if checkpoints were requested."""
+    if checkpoint_dir:
+        step_dir = os.path.join(checkpoint_dir, CHECKPOINT_DIRS[step])
+        os.makedirs(step_dir, exist_ok=True)
+        Path(step_dir, f"{name}.txt").write_text(text, encoding='utf-8')
+
+def _init_worker():
+    """Keeps each worker's OCR/layout models single-threaded so the pool doesn't oversubscribe the CPU."""
+    os.environ["OMP_NUM_THREADS"] = "1"
+
+def _ingest_and_clean(file_path: str, keep_raw: bool):
+    """
+    Worker: steps 1 and 2 for one file. Returns (raw_text, cleaned_text);
+    raw_text is only sent back when it is needed for a checkpoint.
+    Returns (None, None) if the file has no content or couldn't be processed.
+    """
+    try:
+        raw_text = extract_text_from_file(file_path)
+        if not raw_text:
+            return None, None
+        return (raw_text if keep_raw else None), clean_text_with_rules(raw_text)
+    except Exception as e:
+        # An exception here would re-raise from executor.map and stop the whole pipeline.
+        print(f"\nCould not process {os.path.basename(file_path)}. Error: {e}")
+        return None, None
+
+def sentencize_documents(texts: dict) -> dict:
+    """
+    Step 3 in memory: returns {name: [paragraph, ...]} with each paragraph's sentences
+    rebuilt by spaCy. Paragraphs of all documents go through one nlp.pipe() call per language.
+    """
+    queued_paragraphs = {"en": [], "zh": []}
+    for name, text in texts.items():
+        lang = "zh" if step3.contains_chinese(text, step3.LANG_DETECT_CHARS) else "en"
+        queued_paragraphs[lang].extend((para, name) for para in step3.split_paragraphs(text))
+
+    paragraphs_by_doc = {name: [] for name in texts}
+    for lang, nlp_model in (("en", step3.NLP_EN), ("zh", step3.NLP_ZH)):
+        paragraphs = queued_paragraphs[lang]
+        if not paragraphs:
+            continue
+        if not nlp_model:
+            # Without a model, the paragraphs pass through unchanged.
+            print(f"  - WARNING: spaCy model for '{lang}' not available. Skipping parsing for those files.")
+            for para, name in paragraphs:
+                paragraphs_by_doc[name].append(para)
+            continue
+        docs = nlp_model.pipe(paragraphs, as_tuples=True, batch_size=step3.PIPE_BATCH_SIZE, n_process=step3.N_PROCESS)
+        for doc, name in tqdm(docs, total=len(paragraphs), desc=f"Parsing {lang} paragraphs"):
+            paragraphs_by_doc[name].append(step3.reconstruct_paragraph(doc))
+    return paragraphs_by_doc
+
+async def prune_documents(texts: dict) -> dict:
+    """Step 4 in memory: prunes every document concurrently. Returns {name: pruned_text}."""
+    client = ollama.AsyncClient()
+    semaphore = asyncio.Semaphore(step4.MAX_CONCURRENT_REQUESTS)
+
+    async def prune_one(name: str, text: str) -> str:
+        async with semaphore:
+            try:
+                return await step4.prune_document(client, text, name)
+            except Exception as e:
+                print(f"\nCould not prune {name}. Error: {e}")
+                return text
+
+    pruned = await asyncio.gather(*(prune_one(name, text) for name, text in texts.items()))
+    return dict(zip(texts, pruned))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs steps 1-5 in one process, handing each document from step to step in memory."
+    )
+    parser.add_argument("source_dir", help="Directory containing source .pdf, .md, .txt, and .docx files.")
+    parser.add_argument("output_dir", help="Directory where the final refined .txt files will be saved.")
+    parser.add_argument(
+        "--checkpoint",
+        metavar="DIR",
+        help="Also save each intermediate step's output under DIR (step1_ingested/, step2_rule_cleaned/, ...)."
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source_dir):
+        print(f"❌ ERROR: Source directory not found at '{args.source_dir}'")
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    all_files = find_supported_files(args.source_dir)
+    print(f"--- Found {len(all_files)} supported files to process. ---")
+
+    pending_files = {}
+    for file_path in all_files:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        if os.path.exists(os.path.join(args.output_dir, f"{name}.txt")):
+            print(f"  - Skipping '{name}', final output file already exists.")
+            continue
+        pending_files[name] = file_path
+
+    # --- Steps 1 & 2: extraction and rule cleaning, fanned out across cores ---
+    texts = {}
+    keep_raw = bool(args.checkpoint)
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as executor:
+        results = executor.map(_ingest_and_clean, pending_files.values(), repeat(keep_raw), chunksize=2)
+        for name, (raw_text, cleaned_text) in tqdm(zip(pending_files, results), total=len(pending_files),
+                                                   desc="Ingesting and cleaning files"):
+            if not cleaned_text:
+                tqdm.write(f"  - No content extracted from '{name}'. Skipping.")
+                continue
+            write_checkpoint(args.checkpoint, 1, name, raw_text)
+            write_checkpoint(args.checkpoint, 2, name, cleaned_text)
+            texts[name] = cleaned_text
+
+    if not texts:
+        print("No documents to refine.")
+        return
+
+    # --- Step 3: sentence parsing ---
+    paragraphs_by_doc = sentencize_documents(texts)
+    texts = {name: "\n\n".join(paragraphs) for name, paragraphs in paragraphs_by_doc.items()}
+    for name, text in texts.items():
+        write_checkpoint(args.checkpoint, 3, name, text)
+
+    # --- Step 4: LLM pruning ---
+    print(f"--- Pruning {len(texts)} documents with model '{step4.MODEL_NAME}'... ---")
+    texts = asyncio.run(prune_documents(texts))
+    for name, text in texts.items():
+        write_checkpoint(args.checkpoint, 4, name, text)
+
+    # --- Step 5: LLM refinement, written straight to the output directory ---
+    client = ollama.Client()
+    print(f"--- Refining {len(texts)} documents with model '{step5.MODEL_NAME}'... ---")
+    for name, text in texts.items():
+        try:
+            final_text = step5.refine_text(client, text, name)
+            Path(args.output_dir, f"{name}.txt").write_text(final_text, encoding='utf-8')
+        except Exception as e:
+            print(f"\nCould not refine {name}. Error: {e}")
+
+    print(f"\n--- Pipeline complete. Final files are in {args.output_dir} ---")
+
+if __name__ == "__main__":
+    main()
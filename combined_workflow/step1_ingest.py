@@ -1,30 +1,52 @@
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
 from tqdm import tqdm
 #from unstructured.partition.api import partition_via_api
 from unstructured.partition.auto import partition
 
+# Extensions that are read as-is instead of going through unstructured.
+PLAIN_TEXT_EXTENSIONS = ('.txt', '.md')
+
 def find_supported_files(directory: str) -> list:
     """Finds all supported files (.pdf, .txt, .md, .docx) in a directory."""
     supported_files = []
-    supported_extensions = ['.pdf', '.md', '.txt', '.docx']
+    supported_extensions = ('.pdf', '.md', '.txt', '.docx')
     print(f"--- Scanning for supported files in: {directory} ---")
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if not file.startswith('.') and any(file.lower().endswith(ext) for ext in supported_extensions):
-                supported_files.append(os.path.join(root, file))
+    # Walk the tree with os.scandir: DirEntry already knows its name and type,
+    # so no extra stat calls are needed. Symlinked directories are not followed, as with os.walk.
+    pending_dirs = [directory]
+    while pending_dirs:
+        with os.scandir(pending_dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                elif not entry.name.startswith('.') and entry.name.lower().endswith(supported_extensions):
+                    supported_files.append(entry.path)
     return supported_files
 
 def extract_text_from_file(file_path: str) -> str:
     """
-    Uses the universal `partition` function to extract text elements,
-    automatically handling PDF, MD, and TXT files.
+    Extracts the raw text of a file. Plain .txt and .md files are read directly;
+    .pdf and .docx files go through the universal `partition` function.
     """
+    if os.path.splitext(file_path)[1].lower() in PLAIN_TEXT_EXTENSIONS:
+        # No layout analysis or OCR is needed for plain text.
+        try:
+            return Path(file_path).read_text(encoding='utf-8', errors='replace')
+        except Exception as e:
+            print(f"  - ERROR: Could not read file {os.path.basename(file_path)}. Reason: {e}")
+            return None
+
     print(f"\n-> Processing file with unstructured: {os.path.basename(file_path)}")
     try:
+        # "auto" uses the fast text-layer extraction for PDFs that have one,
+        # and only falls back to OCR for scanned documents.
         elements = partition(
             filename=file_path,
-            strategy="hi_res",
+            strategy="auto",
             languages=["eng", "chi_sim"]
         )
         return "\n\n".join([el.text for el in elements if el.text and el.text.strip()])
@@ -32,6 +54,25 @@ def extract_text_from_file(file_path: str) -> str:
         print(f"  - ERROR: Could not process file with unstructured. Reason: {e}")
         return None
 
+def _init_ingest_worker():
+    """Keeps each worker's OCR/layout models single-threaded so the pool doesn't oversubscribe the CPU."""
+    os.environ["OMP_NUM_THREADS"] = "1"
+
+def _ingest_one(file_path: str, output_dir: str) -> str:
+    """
+    Worker: extracts the text of one file and saves it as .txt in output_dir.
+    Returns a status line for the progress log.
+    """
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    output_path = os.path.join(output_dir, f"{base_name}.txt")
+
+    raw_text = extract_text_from_file(file_path)
+    if not raw_text:
+        return f"  - No content extracted from '{base_name}'. Skipping."
+
+    Path(output_path).write_text(raw_text, encoding='utf-8')
+    return f"  - ✅ Saved extracted text from '{base_name}' to a .txt file."
+
 def main():
     parser = argparse.ArgumentParser(description="Step 1: Ingest and extract raw text from various document formats.")
     parser.add_argument("source_dir", help="Directory containing source .pdf, .md, .txt, and .docx files.")
@@ -46,23 +87,28 @@ def main():
     all_files = find_supported_files(args.source_dir)
     print(f"--- Found {len(all_files)} supported files to process. ---")
 
-    for file_path in tqdm(all_files, desc="Ingesting files"):
+    # Check for existing outputs up front so skipped files are never sent to a worker.
+    # Files with the same name in different subdirectories share an output file: as when
+    # they were ingested one by one, only the first one found is ingested.
+    pending_files = []
+    pending_names = set()
+    for file_path in all_files:
         base_name = os.path.splitext(os.path.basename(file_path))[0]
         output_path = os.path.join(args.output_dir, f"{base_name}.txt")
-
-        if os.path.exists(output_path):
-            tqdm.write(f"  - Skipping '{base_name}', output file already exists.")
+        if base_name in pending_names:
+            print(f"  - WARNING: Skipping '{file_path}', another '{base_name}' file is already being ingested.")
             continue
-
-        raw_text = extract_text_from_file(file_path)
-        if not raw_text:
-            tqdm.write(f"  - No content extracted from '{base_name}'. Skipping.")
+        if os.path.exists(output_path):
+            print(f"  - Skipping '{base_name}', output file already exists.")
             continue
+        pending_names.add(base_name)
+        pending_files.append(file_path)
 
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(raw_text)
-
-        tqdm.write(f"  - ✅ Saved extracted text from '{base_name}' to a .txt file.")
+    # Extraction (PDF parsing, OCR) is CPU-bound and independent per file, so fan out across cores.
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_ingest_worker) as executor:
+        results = executor.map(_ingest_one, pending_files, repeat(args.output_dir), chunksize=2)
+        for message in tqdm(results, total=len(pending_files), desc="Ingesting files"):
+            tqdm.write(message)
 
     print("\n--- Step 1: Ingestion complete for all files. ---")
 
@@ -1,69 +1,74 @@
 import os
+import re
 import spacy
 import argparse
+from pathlib import Path
 from tqdm import tqdm
 
 # --- LOAD SPACY MODELS ---
-# We load both English and Chinese models. We will decide which one to use on a per-file basis.
-# We disable components we don't need (ner, parser) to speed up sentence boundary detection.
-def load_spacy_model(model_name: str):
+# We load both English and Chinese pipelines. We will decide which one to use on a per-file basis.
+# Only sentence boundaries are needed, so each pipeline is a blank language with just the
+# rule-based sentencizer: no transformer or other trained components to run.
+def load_spacy_model(lang_code: str):
     try:
-        nlp = spacy.load(model_name, disable=["ner", "parser"])
+        nlp = spacy.blank(lang_code)
         nlp.add_pipe('sentencizer')
         nlp.max_length = 2000000  # Increase max length for long documents
-        print(f"spaCy model '{model_name}' loaded successfully.")
+        print(f"spaCy blank '{lang_code}' pipeline with sentencizer loaded successfully.")
         return nlp
-    except OSError:
-        print(f"spaCy model '{model_name}' not found. Please run: python -m spacy download {model_name}")
+    except (ImportError, ValueError) as e:
+        print(f"spaCy pipeline for '{lang_code}' could not be created: {e}")
         return None
 
 # Attempt to load both models at the start
-NLP_EN = load_spacy_model("en_core_web_trf")
-NLP_ZH = load_spacy_model("zh_core_web_trf")
+NLP_EN = load_spacy_model("en")
+NLP_ZH = load_spacy_model("zh")
 
-def contains_chinese(text: str) -> bool:
-    """Checks if a string contains any Chinese characters."""
-    for char in text:
-        if '\u4e00' <= char <= '\u9fff':
-            return True
-    return False
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+# Language detection only looks at the start of each document.
+LANG_DETECT_CHARS = 1000
 
-def parse_and_reconstruct(text: str, nlp_model) -> str:
-    """
-    Uses a loaded spaCy model to perform accurate sentence boundary detection
-    and reconstructs the document with clean paragraph and sentence structure.
-    """
-    if not nlp_model:
-        print("  - WARNING: spaCy model not available. Skipping parsing.")
-        return text
+def contains_chinese(text: str, endpos: int = None) -> bool:
+    """Checks if a string (up to endpos) contains any Chinese characters."""
+    if endpos is None:
+        endpos = len(text)
+    return CJK_PATTERN.search(text, 0, endpos) is not None
 
-    # Text is split into paragraphs based on the double newlines from the previous step.
-    paragraphs = text.split('\n\n')
-    reconstructed_paragraphs = []
+# Paragraphs from all files are batched through spaCy with nlp.pipe().
+PIPE_BATCH_SIZE = 256
+N_PROCESS = max(1, (os.cpu_count() or 1) - 1)
 
-    for para in paragraphs:
-        para = para.strip()
-        if not para:
-            continue
+def split_paragraphs(text: str) -> list:
+    """Splits text into non-empty paragraphs based on the double newlines from the previous step."""
+    return [para.strip() for para in text.split('\n\n') if para.strip()]
 
-        doc = nlp_model(para)
+def reconstruct_paragraph(doc) -> str:
+    """Cleans up each sentence spaCy found in a paragraph and joins them back together."""
+    return " ".join(sent.text.strip().replace('\n', ' ') for sent in doc.sents)
 
-        reconstructed_sentences = []
-        for sent in doc.sents:
-            # Clean up each sentence found by spaCy.
-            clean_sentence = sent.text.strip().replace('\n', ' ')
-            reconstructed_sentences.append(clean_sentence)
-
-        # Join the validated sentences back together to form a clean paragraph.
-        reconstructed_paragraphs.append(" ".join(reconstructed_sentences))
+def write_paragraphs(paragraphs, output_fh):
+    """
+    Writes a document's rebuilt paragraphs to output_fh, separated by double newlines
+    to restore the document structure, without joining them into one string first.
+    """
+    for i, paragraph in enumerate(paragraphs):
+        if i:
+            output_fh.write("\n\n")
+        output_fh.write(paragraph)
 
-    # Join the clean paragraphs with double newlines to restore document structure.
-    return "\n\n".join(reconstructed_paragraphs)
+def detect_language(input_path: str) -> str:
+    """Returns "zh" or "en" for a file, reading only its first LANG_DETECT_CHARS characters."""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        head = f.read(LANG_DETECT_CHARS)
+    return "zh" if contains_chinese(head) else "en"
 
 
 def process_directory(input_dir: str, output_dir: str):
     """
     Processes all .txt files from the rule-cleaning step directory.
+    The paragraphs of all files are streamed through spaCy in one batched nlp.pipe() call
+    per language. Each file is read only when the pipe needs its paragraphs, and written
+    (and forgotten) as soon as its last paragraph comes back.
     """
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory not found at {input_dir}")
@@ -71,7 +76,7 @@ def process_directory(input_dir: str, output_dir: str):
 
     os.makedirs(output_dir, exist_ok=True)
 
-    filenames = sorted([f for f in os.listdir(input_dir) if f.endswith(".txt")])
+    filenames = sorted(e.name for e in os.scandir(input_dir) if e.is_file() and e.name.endswith(".txt"))
 
     if not filenames:
         print(f"No .txt files found in {input_dir}")
@@ -79,29 +84,90 @@ def process_directory(input_dir: str, output_dir: str):
 
     print(f"--- Found {len(filenames)} files. Starting Step 3: Sentence Parsing... ---")
 
-    for filename in tqdm(filenames, desc="Parsing files"):
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename)
+    def write_output(file_id: int, paragraphs):
+        filename = filenames[file_id]
+        try:
+            with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+                write_paragraphs(paragraphs, f)
+        except Exception as e:
+            print(f"\nCould not process {filename}. Error: {e}")
 
+    def write_unchanged(file_id: int):
         try:
-            with open(input_path, 'r', encoding='utf-8') as f:
-                cleaned_text = f.read()
-
-            # Auto-detect language and select the appropriate spaCy model.
-            # We check the first 1000 characters for efficiency.
-            if contains_chinese(cleaned_text[:1000]):
-                tqdm.write(f"  - Detected Chinese text in {filename}. Using 'zh_core_web_trf'.")
-                nlp_to_use = NLP_ZH
-            else:
-                tqdm.write(f"  - Detected English text in {filename}. Using 'en_core_web_trf'.")
-                nlp_to_use = NLP_EN
-
-            parsed_text = parse_and_reconstruct(cleaned_text, nlp_to_use)
-
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(parsed_text)
+            cleaned_text = Path(input_dir, filenames[file_id]).read_text(encoding='utf-8')
+        except Exception as e:
+            print(f"\nCould not process {filenames[file_id]}. Error: {e}")
+            return
+        write_output(file_id, [cleaned_text])
+
+    # 1. Auto-detect each file's language and select the appropriate spaCy model.
+    # Only the start of each file is read here.
+    file_ids_by_lang = {"en": [], "zh": []}
+    for file_id, filename in enumerate(tqdm(filenames, desc="Detecting languages")):
+        try:
+            lang = detect_language(os.path.join(input_dir, filename))
         except Exception as e:
             print(f"\nCould not process {filename}. Error: {e}")
+            continue
+        if lang == "zh":
+            tqdm.write(f"  - Detected Chinese text in {filename}. Using the Chinese sentencizer.")
+        else:
+            tqdm.write(f"  - Detected English text in {filename}. Using the English sentencizer.")
+        file_ids_by_lang[lang].append(file_id)
+
+    # 2. Stream each language's paragraphs through spaCy in one batched pipe() call.
+    for lang, nlp_model in (("en", NLP_EN), ("zh", NLP_ZH)):
+        file_ids = file_ids_by_lang[lang]
+        if not file_ids:
+            continue
+        if not nlp_model:
+            # Without a model, those files are written out unchanged.
+            print(f"  - WARNING: spaCy model for '{lang}' not available. Skipping parsing for those files.")
+            for file_id in file_ids:
+                write_unchanged(file_id)
+            continue
+
+        # Rebuilt paragraphs of the files that are in flight, and how many each file has.
+        rebuilt = {}
+        paragraph_counts = {}
+        # Files not yet written or given up on.
+        pending = set(file_ids)
+
+        def queued_paragraphs():
+            """Yields (paragraph, file_id) for every file of this language, reading one file at a time."""
+            for file_id in file_ids:
+                try:
+                    cleaned_text = Path(input_dir, filenames[file_id]).read_text(encoding='utf-8')
+                except Exception as e:
+                    print(f"\nCould not process {filenames[file_id]}. Error: {e}")
+                    pending.discard(file_id)
+                    continue
+                paragraphs = split_paragraphs(cleaned_text)
+                del cleaned_text
+                if not paragraphs:
+                    write_output(file_id, [])
+                    pending.discard(file_id)
+                    continue
+                paragraph_counts[file_id] = len(paragraphs)
+                rebuilt[file_id] = []
+                yield from ((para, file_id) for para in paragraphs)
+
+        try:
+            docs = nlp_model.pipe(queued_paragraphs(), as_tuples=True, batch_size=PIPE_BATCH_SIZE, n_process=N_PROCESS)
+            for doc, file_id in tqdm(docs, desc=f"Parsing {lang} paragraphs"):
+                paragraphs = rebuilt[file_id]
+                paragraphs.append(reconstruct_paragraph(doc))
+                if len(paragraphs) == paragraph_counts[file_id]:
+                    write_output(file_id, rebuilt.pop(file_id))
+                    pending.discard(file_id)
+        except Exception as e:
+            # A bad paragraph or a crashed worker stops the whole pipe; the files it hadn't
+            # finished are written out unchanged, as when the model is missing.
+            print(f"\n  - WARNING: spaCy parsing of '{lang}' files failed: {e}. "
+                  f"Writing {len(pending)} unfinished files unchanged.")
+            rebuilt.clear()
+            for file_id in sorted(pending):
+                write_unchanged(file_id)
 
     print(f"\n--- Step 3: Sentence parsing complete. Parsed files are in {output_dir} ---")
 
@@ -1,13 +1,27 @@
 import os
+import mmap
+import shutil
+import asyncio
 import ollama
 import json
-import re
+# orjson is a much faster C parser; fall back to the stdlib if it isn't installed.
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 import argparse
 from tqdm import tqdm
 from pathlib import Path
 
 # --- CONFIGURATION ---
 MODEL_NAME = "llama3.1:8b-instruct-fp16"
+# Files analyzed concurrently. Match the server's OLLAMA_NUM_PARALLEL setting.
+MAX_CONCURRENT_REQUESTS = 8
+# Paragraphs from each end of the document that are shown to the LLM.
+SAMPLE_SIZE = 20
+# Bytes read from each end of a file to find those paragraphs without loading the whole file.
+SAMPLE_BYTES = 64 * 1024
 
 # --- PROMPT ENGINEERING ---
 PRUNING_PROMPT_TEMPLATE = """
@@ -48,13 +62,12 @@ Now, analyze this document's paragraphs:
 Provide only the raw JSON object as your response.
 """
 
-def get_pruning_parameters(client: ollama.Client, paragraphs: list) -> dict:
+async def get_pruning_parameters(client: ollama.AsyncClient, paragraphs: list) -> dict:
     """
     Uses an LLM to find the start and end headings for the main document body.
     """
     # For efficiency, we only send the first and last N paragraphs to the LLM
     # as this is where the relevant headings are most likely to be.
-    SAMPLE_SIZE = 20
     head = paragraphs[:SAMPLE_SIZE]
     tail = paragraphs[-SAMPLE_SIZE:]
 
@@ -64,12 +77,12 @@ def get_pruning_parameters(client: ollama.Client, paragraphs: list) -> dict:
     prompt = PRUNING_PROMPT_TEMPLATE.format(paragraph_list=paragraph_text_for_llm)
 
     try:
-        response = client.chat(
+        response = await client.chat(
             model=MODEL_NAME,
             messages=[{'role': 'user', 'content': prompt}],
             format='json'
         )
-        params = json.loads(response['message']['content'])
+        params = _loads(response['message']['content'])
 
         # Validate the output from the LLM
         if isinstance(params, dict) and "start_heading" in params and "end_heading" in params:
@@ -82,31 +95,142 @@ def get_pruning_parameters(client: ollama.Client, paragraphs: list) -> dict:
         print(f"  - WARNING: LLM analysis for pruning failed: {e}. Skipping pruning.")
         return None
 
-def prune_text_body(text: str, params: dict) -> str:
+def find_body_span(text, start_heading, end_heading):
+    """
+    Returns the (start, end) offsets of the body between the first start heading and the
+    first end heading after it, or None. Works on str, bytes and mmap alike.
     """
-    Extracts the main body of text between a start and an end heading using regex.
+    # The headings are literal text, so two linear find scans are enough
+    # (the same span a non-greedy start(.*?)end regex would match).
+    start_idx = text.find(start_heading)
+    if start_idx < 0:
+        return None
+    start_idx += len(start_heading)
+    end_idx = text.find(end_heading, start_idx)
+    return (start_idx, end_idx) if end_idx >= 0 else None
+
+def extract_body(data, params: dict):
+    """
+    Returns the stripped main body of data (str, or UTF-8 bytes/mmap) between the LLM's
+    start and end headings, or None if it can't be pruned.
     """
     start_heading = params.get("start_heading")
     end_heading = params.get("end_heading")
 
-    # If headings are missing or empty, return the original text
+    # If headings are missing or empty, keep the original text
     if not start_heading or not end_heading:
         print("  - INFO: No valid start/end headings found by LLM. Skipping pruning.")
-        return text
+        return None
 
-    # Escape special regex characters in the headings to ensure they are treated as literals
-    start_pattern = re.escape(start_heading)
-    end_pattern = re.escape(end_heading)
+    if isinstance(data, str):
+        span = find_body_span(data, start_heading, end_heading)
+        body = data[span[0]:span[1]] if span else None
+    else:
+        # UTF-8 is self-synchronizing, so a byte match is always a match of whole characters.
+        span = find_body_span(data, start_heading.encode('utf-8'), end_heading.encode('utf-8'))
+        body = data[span[0]:span[1]].decode('utf-8') if span else None
 
-    # Use regex to find the content between the start and end patterns. re.DOTALL allows '.' to match newlines.
-    match = re.search(f"{start_pattern}(.*?){end_pattern}", text, re.DOTALL)
+    if body is None:
+        print("  - WARNING: Could not find the specified start/end headings in the text. Skipping pruning.")
+        return None
+    print(f"  - SUCCESS: Extracted main body between '{start_heading}' and '{end_heading}'.")
+    return body.strip()
 
-    if match:
-        print(f"  - SUCCESS: Extracted main body between '{start_heading}' and '{end_heading}'.")
-        return match.group(1).strip()
-    else:
-        print(f"  - WARNING: Could not find the specified start/end headings in the text. Skipping pruning.")
-        return text
+def prune_text_body(text: str, params: dict) -> str:
+    """
+    Extracts the main body of text between a start and an end heading.
+    """
+    body = extract_body(text, params)
+    return text if body is None else body
+
+def prune_file_body(file_path: str, params: dict):
+    """
+    Like prune_text_body, but searches the file through mmap and decodes only the body.
+    Returns None if the file should be kept as-is.
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return extract_body(mm, params)
+
+def read_sample_paragraphs(file_path: str):
+    """
+    Returns the first and last SAMPLE_SIZE paragraphs of a large file, reading only
+    SAMPLE_BYTES from each end. Returns None if the whole file has to be read instead:
+    it is small, or the sampled bytes don't hold enough complete paragraphs.
+    """
+    if os.path.getsize(file_path) <= 2 * SAMPLE_BYTES:
+        return None
+
+    with open(file_path, 'rb') as f:
+        head = f.read(SAMPLE_BYTES)
+        f.seek(-SAMPLE_BYTES, os.SEEK_END)
+        tail = f.read()
+
+    # The piece at each cut may be a partial paragraph (or even a partial character), so drop it.
+    # Splitting the bytes on b'\n\n' gives the same pieces as splitting the decoded text.
+    head_paragraphs = [p for p in (b.decode('utf-8').strip() for b in head.split(b'\n\n')[:-1]) if p]
+    tail_paragraphs = [p for p in (b.decode('utf-8').strip() for b in tail.split(b'\n\n')[1:]) if p]
+    if len(head_paragraphs) < SAMPLE_SIZE or len(tail_paragraphs) < SAMPLE_SIZE:
+        return None
+
+    return head_paragraphs[:SAMPLE_SIZE] + tail_paragraphs[-SAMPLE_SIZE:]
+
+async def prune_document(client: ollama.AsyncClient, full_text: str, filename: str) -> str:
+    """
+    Returns the main body of one document's text, or the full text if it can't be pruned.
+    """
+    paragraphs = [p.strip() for p in full_text.split('\n\n') if p.strip()]
+
+    if len(paragraphs) < (2 * 5): # If document is too short, skip pruning
+        tqdm.write(f"  - Skipping pruning for short document: {filename}")
+        return full_text
+
+    pruning_params = await get_pruning_parameters(client, paragraphs)
+    if pruning_params:
+        return prune_text_body(full_text, pruning_params)
+    return full_text # Fallback to full text if LLM fails
+
+async def process_file(client: ollama.AsyncClient, semaphore: asyncio.Semaphore, filename: str,
+                       input_path: str, output_path: str, progress: tqdm):
+    """
+    Prunes a single file. The semaphore caps how many files talk to the LLM at once.
+    """
+    async with semaphore:
+        try:
+            # Large files: sample both ends for the LLM, and only map the whole file
+            # once there are headings to search for.
+            sample = await asyncio.to_thread(read_sample_paragraphs, input_path)
+            if sample is not None:
+                pruning_params = await get_pruning_parameters(client, sample)
+                pruned_text = None
+                if pruning_params:
+                    pruned_text = await asyncio.to_thread(prune_file_body, input_path, pruning_params)
+                if pruned_text is None:
+                    await asyncio.to_thread(shutil.copyfile, input_path, output_path)
+                    return
+            else:
+                full_text = await asyncio.to_thread(Path(input_path).read_text, encoding="utf-8")
+                pruned_text = await prune_document(client, full_text, filename)
+            await asyncio.to_thread(Path(output_path).write_text, pruned_text, encoding='utf-8')
+
+        except Exception as e:
+            print(f"\nCould not process {filename}. Error: {e}")
+        finally:
+            progress.update(1)
+
+async def process_directory_async(input_dir: str, output_dir: str, filenames: list):
+    """
+    Prunes all files concurrently: while one file waits on the LLM, others are in flight.
+    """
+    client = ollama.AsyncClient()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    progress = tqdm(total=len(filenames), desc="Pruning files")
+    tasks = [
+        process_file(client, semaphore, filename,
+                     os.path.join(input_dir, filename), os.path.join(output_dir, filename), progress)
+        for filename in filenames
+    ]
+    await asyncio.gather(*tasks)
+    progress.close()
 
 def process_directory(input_dir: str, output_dir: str):
     """
@@ -118,37 +242,14 @@ def process_directory(input_dir: str, output_dir: str):
 
     os.makedirs(output_dir, exist_ok=True)
 
-    filenames = sorted([f for f in os.listdir(input_dir) if f.endswith(".txt")])
+    filenames = sorted(e.name for e in os.scandir(input_dir) if e.is_file() and e.name.endswith(".txt"))
     if not filenames:
         print(f"No .txt files found in {input_dir}")
         return
 
-    client = ollama.Client()
     print(f"--- Found {len(filenames)} files. Starting Step 4: LLM Pruning with model '{MODEL_NAME}'... ---")
 
-    for filename in tqdm(filenames, desc="Pruning files"):
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename)
-
-        try:
-            full_text = Path(input_path).read_text(encoding="utf-8")
-            paragraphs = [p.strip() for p in full_text.split('\n\n') if p.strip()]
-
-            if len(paragraphs) < (2 * 5): # If document is too short, skip pruning
-                tqdm.write(f"  - Skipping pruning for short document: {filename}")
-                pruned_text = full_text
-            else:
-                pruning_params = get_pruning_parameters(client, paragraphs)
-                if pruning_params:
-                    pruned_text = prune_text_body(full_text, pruning_params)
-                else:
-                    pruned_text = full_text # Fallback to full text if LLM fails
-
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(pruned_text)
-
-        except Exception as e:
-            print(f"\nCould not process {filename}. Error: {e}")
+    asyncio.run(process_directory_async(input_dir, output_dir, filenames))
 
     print(f"\n--- Step 4: LLM pruning complete. Pruned files are in {output_dir} ---")
 
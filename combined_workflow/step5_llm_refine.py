@@ -1,7 +1,19 @@
 import os
+import re
 import ollama
 import json
+# orjson is a much faster C parser; fall back to the stdlib if it isn't installed.
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+import math
+import hashlib
+import sqlite3
+import threading
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import traceback
 
@@ -10,11 +22,43 @@ MODEL_NAME = "llama3.1:8b-instruct-fp16"  # A capable model for classification a
 SCORE_THRESHOLD = 7              # Chunks scoring below this will be sent for repair.
 CHUNK_SIZE = 5                   # Number of paragraphs per chunk.
 CHUNK_OVERLAP = 1                # Paragraph overlap to avoid cutting sentences in half.
+# In-flight requests to the Ollama server. Match the server's OLLAMA_NUM_PARALLEL setting.
+MAX_CONCURRENT_REQUESTS = 4
+
+# On-disk cache of LLM verdicts and repairs, keyed by chunk content, so re-runs and
+# repeated boilerplate skip the LLM.
+CACHE_PATH = os.path.expanduser("~/.cache/step5_llm.db")
+# Optional near-duplicate tier for the classifier: set to an Ollama embedding model
+# (e.g. "nomic-embed-text") to reuse the verdict of any earlier chunk in this run whose
+# embedding has cosine similarity >= SEMANTIC_CACHE_THRESHOLD. Disabled by default.
+SEMANTIC_CACHE_MODEL = None
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+# Chunks that pass every check in quick_score are treated as clean without asking the LLM.
+ENABLE_QUICK_SCORE = True
+QUICK_PASS_SCORE = 10
+# Average sentence length (in characters) outside this range is suspicious.
+QUICK_MIN_AVG_SENTENCE_CHARS = 8
+QUICK_MAX_AVG_SENTENCE_CHARS = 400
+
+# --- QUICK SCORE PATTERNS ---
+# A paragraph that ends like a sentence (optionally inside closing quotes/brackets).
+PARAGRAPH_END_PATTERN = re.compile(r'[.!?。！？][”"’\'」』）)]*\Z')
+# A paragraph that starts mid-sentence: a lowercase letter or sentence-internal punctuation.
+PARAGRAPH_START_PATTERN = re.compile(r'\A[a-z,;:，；：、)）]')
+# Signs of a bad join or split: a line break inside a paragraph, a hyphen left at a
+# line-broken word, a lowercase word right after a sentence end, or doubled punctuation.
+BROKEN_STRUCTURE_PATTERN = re.compile(r'\n|\w- \w|[.!?] [a-z]|[,，.。]{2,}')
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?。！？])\s*')
+
+# How long Ollama keeps the model (and its prompt KV-cache) loaded between requests.
+KEEP_ALIVE = "30m"
 
 # --- PROMPT ENGINEERING ---
 
-# Escaped curly braces for safe .format() execution.
-CLASSIFIER_PROMPT_TEMPLATE = """
+# The fixed instructions go in the system message and only the chunk goes in the user message,
+# so every request shares an identical prefix that Ollama can reuse from its KV-cache.
+CLASSIFIER_SYSTEM_PROMPT = """
 You are a meticulous text quality analyst. Your task is to evaluate a text segment for signs of poor PDF-to-text conversion.
 Analyze the following text for structural errors like incorrectly broken sentences, merged paragraphs, or nonsensical line breaks.
 Focus ONLY on structure, grammar, and logical flow. Do not evaluate factual content.
@@ -25,23 +69,25 @@ After your analysis, provide a single, valid JSON object with two keys:
 
 <example_good>
 Text: "The study concluded that further research was necessary. Participants were recruited from a local university."
-JSON: {{"score": 10, "reason": "The text is well-structured with complete sentences."}}
+JSON: {"score": 10, "reason": "The text is well-structured with complete sentences."}
 </example_good>
 
 <example_bad>
 Text: "The study concluded that further. Research was necessary participants were recruited from a local university."
-JSON: {{"score": 3, "reason": "A sentence is incorrectly broken after 'further' and improperly merged with the next thought."}}
+JSON: {"score": 3, "reason": "A sentence is incorrectly broken after 'further' and improperly merged with the next thought."}
 </example_bad>
 
+Provide only the raw JSON object as your response.
+"""
+
+CLASSIFIER_USER_TEMPLATE = """
 Now, evaluate this text:
 <text_to_analyze>
 {text_chunk}
 </text_to_analyze>
-
-Provide only the raw JSON object as your response.
 """
 
-REPAIR_PROMPT_TEMPLATE = """
+REPAIR_SYSTEM_PROMPT = """
 You are an expert text editor. You will be given a piece of text that was flagged for a specific structural error resulting from a bad PDF conversion.
 Your task is to fix ONLY the identified problem and return the corrected text.
 
@@ -51,7 +97,9 @@ Your task is to fix ONLY the identified problem and return the corrected text.
 3.  Do NOT change the meaning of the text.
 4.  Preserve the original paragraph structure.
 5.  Return only the corrected text, with no preamble or explanation.
+"""
 
+REPAIR_USER_TEMPLATE = """
 **Reason for flagging:** {reason}
 
 **Problematic Text:**
@@ -62,24 +110,97 @@ Your task is to fix ONLY the identified problem and return the corrected text.
 **Corrected Text:**
 """
 
+# --- LLM RESULT CACHE ---
+_cache_lock = threading.Lock()
+_cache_conn = None
+_semantic_entries = []  # (unit-length embedding, classification) pairs seen this run
+
+def _cache_key(*parts: str) -> str:
+    """Builds a cache key from the model name and the given strings."""
+    data = "\x00".join((MODEL_NAME,) + parts).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _get_cache() -> sqlite3.Connection:
+    """Opens the cache database on first use. Callers must hold _cache_lock."""
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        _cache_conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return _cache_conn
+
+def cache_get(key: str):
+    """Returns the cached JSON value for key, or None."""
+    with _cache_lock:
+        row = _get_cache().execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    return _loads(row[0]) if row else None
+
+def cache_put(key: str, value) -> None:
+    """Stores a JSON-serializable value under key."""
+    with _cache_lock:
+        conn = _get_cache()
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        conn.commit()
+
+def embed_chunk(client: ollama.Client, text_chunk: str):
+    """Returns the unit-length embedding of a chunk, or None if the semantic tier is off or fails."""
+    if not SEMANTIC_CACHE_MODEL:
+        return None
+    try:
+        vector = client.embeddings(model=SEMANTIC_CACHE_MODEL, prompt=text_chunk)['embedding']
+    except Exception as e:
+        print(f"  - Embedding error: {e}. Skipping semantic cache.")
+        return None
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def semantic_cache_get(vector):
+    """Returns the classification of the most similar cached chunk above the threshold, or None."""
+    best_score, best_result = SEMANTIC_CACHE_THRESHOLD, None
+    for cached_vector, result in _semantic_entries:
+        similarity = sum(a * b for a, b in zip(vector, cached_vector))
+        if similarity >= best_score:
+            best_score, best_result = similarity, result
+    return best_result
+
 def classify_chunk(client: ollama.Client, text_chunk: str) -> dict:
     """
     Uses the LLM to score a text chunk and gracefully handles errors.
+    Exact repeats are served from the on-disk cache, near-duplicates from the optional semantic tier.
     """
-    prompt = CLASSIFIER_PROMPT_TEMPLATE.format(text_chunk=text_chunk)
+    key = _cache_key("classify", text_chunk)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
+    vector = embed_chunk(client, text_chunk)
+    if vector is not None:
+        cached = semantic_cache_get(vector)
+        if cached is not None:
+            return cached
+
+    prompt = CLASSIFIER_USER_TEMPLATE.format(text_chunk=text_chunk)
     try:
         response = client.chat(
             model=MODEL_NAME,
-            messages=[{'role': 'user', 'content': prompt}],
-            format='json'
+            messages=[
+                {'role': 'system', 'content': CLASSIFIER_SYSTEM_PROMPT},
+                {'role': 'user', 'content': prompt},
+            ],
+            format='json',
+            keep_alive=KEEP_ALIVE
         )
-        result = json.loads(response['message']['content'])
+        result = _loads(response['message']['content'])
 
         score = result.get('score')
         reason = result.get('reason')
 
         if score is not None and reason is not None:
-            return {"score": int(score), "reason": str(reason)}
+            result = {"score": int(score), "reason": str(reason)}
+            cache_put(key, result)
+            if vector is not None:
+                _semantic_entries.append((vector, result))
+            return result
         else:
             print(f"Debug: LLM JSON missing keys. Defaulting to score 1. Response: {result}")
             return {"score": 1, "reason": f"LLM response missing keys: {result}"}
@@ -90,59 +211,106 @@ def classify_chunk(client: ollama.Client, text_chunk: str) -> dict:
 
 def repair_chunk(client: ollama.Client, text_chunk: str, reason: str) -> str:
     """Uses the LLM to repair a text chunk based on a given reason."""
-    prompt = REPAIR_PROMPT_TEMPLATE.format(text_chunk=text_chunk, reason=reason)
+    key = _cache_key("repair", text_chunk, reason)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
+    prompt = REPAIR_USER_TEMPLATE.format(text_chunk=text_chunk, reason=reason)
     try:
         response = client.chat(
             model=MODEL_NAME,
-            messages=[{'role': 'user', 'content': prompt}]
+            messages=[
+                {'role': 'system', 'content': REPAIR_SYSTEM_PROMPT},
+                {'role': 'user', 'content': prompt},
+            ],
+            keep_alive=KEEP_ALIVE
         )
-        return response['message']['content'].strip()
+        repaired = response['message']['content'].strip()
+        cache_put(key, repaired)
+        return repaired
     except Exception as e:
         print(f"  - Repair failed for chunk: {e}. Returning original.")
         return text_chunk
 
+def quick_score(chunk: str) -> int:
+    """
+    Cheap structural checks on a chunk. Returns QUICK_PASS_SCORE if it looks cleanly
+    structured, or 0 if the LLM should have a look.
+    """
+    paragraphs = chunk.split('\n\n')
+    for para in paragraphs:
+        if not PARAGRAPH_END_PATTERN.search(para) or PARAGRAPH_START_PATTERN.search(para):
+            return 0
+        if BROKEN_STRUCTURE_PATTERN.search(para):
+            return 0
+
+    sentences = [s for para in paragraphs for s in SENTENCE_SPLIT_PATTERN.split(para) if s]
+    avg_length = sum(map(len, sentences)) / len(sentences)
+    if not QUICK_MIN_AVG_SENTENCE_CHARS <= avg_length <= QUICK_MAX_AVG_SENTENCE_CHARS:
+        return 0
+
+    return QUICK_PASS_SCORE
+
 def process_file(client: ollama.Client, file_path: str) -> str:
     """Reads, chunks, classifies, repairs, and reassembles a single file."""
     with open(file_path, 'r', encoding='utf-8') as f:
         text = f.read()
 
+    return refine_text(client, text, os.path.basename(file_path))
+
+def refine_text(client: ollama.Client, text: str, name: str) -> str:
+    """Chunks, classifies, repairs, and reassembles the text of one document."""
     paragraphs = text.split('\n\n')
-    if len(paragraphs) == 0:
-        return ""
 
     # Create chunks of paragraphs
     if len(paragraphs) <= CHUNK_SIZE:
         chunks = ["\n\n".join(paragraphs)]
     else:
-        chunks = []
-        for i in range(0, len(paragraphs), CHUNK_SIZE - CHUNK_OVERLAP):
-            chunk = "\n\n".join(paragraphs[i:i + CHUNK_SIZE])
-            chunks.append(chunk)
-
-    repaired_chunks = []
-    print(f"\nProcessing {os.path.basename(file_path)} in {len(chunks)} chunks...")
-
-    for chunk in tqdm(chunks, desc="  - Refining chunks", leave=False):
-        classification = classify_chunk(client, chunk)
-        score = classification.get('score', 1)
-
-        if score < SCORE_THRESHOLD:
-            reason = classification.get('reason', 'Unknown error')
-            tqdm.write(f"  - Chunk scored {score} (<{SCORE_THRESHOLD}). Reason: {reason}. Sending for repair.")
-            repaired_chunk = repair_chunk(client, chunk, reason)
-            repaired_chunks.append(repaired_chunk)
-        else:
-            repaired_chunks.append(chunk)
+        step = CHUNK_SIZE - CHUNK_OVERLAP
+        chunks = ["\n\n".join(paragraphs[i:i + CHUNK_SIZE]) for i in range(0, len(paragraphs), step)]
+
+    print(f"\nProcessing {name} in {len(chunks)} chunks...")
+
+    # Obviously clean chunks skip the LLM classifier entirely.
+    to_classify = [i for i, chunk in enumerate(chunks)
+                   if not (ENABLE_QUICK_SCORE and quick_score(chunk) == QUICK_PASS_SCORE)]
+
+    # The LLM calls are I/O-bound HTTP requests, so keep several in flight at once.
+    # executor.map preserves the chunk order.
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        classifications = tqdm(
+            executor.map(lambda i: classify_chunk(client, chunks[i]), to_classify),
+            total=len(to_classify), desc="  - Refining chunks", leave=False
+        )
+
+        failing = []
+        for i, classification in zip(to_classify, classifications):
+            score = classification.get('score', 1)
+            if score < SCORE_THRESHOLD:
+                reason = classification.get('reason', 'Unknown error')
+                tqdm.write(f"  - Chunk scored {score} (<{SCORE_THRESHOLD}). Reason: {reason}. Sending for repair.")
+                failing.append((i, reason))
+        repairs = executor.map(lambda item: repair_chunk(client, chunks[item[0]], item[1]), failing)
+
+        repaired_chunks = list(chunks)
+        for (i, _), repaired_chunk in zip(failing, repairs):
+            repaired_chunks[i] = repaired_chunk
 
     # Reassemble the document from repaired chunks, removing duplicates caused by overlap.
-    full_text = "\n\n".join(repaired_chunks)
+    # Chunks are split individually instead of joining and re-splitting the whole document,
+    # and each paragraph is hashed once into a 16-byte digest.
     final_paragraphs = []
-    seen_paragraphs = set()
-    for para in full_text.split('\n\n'):
-        para_strip = para.strip()
-        if para_strip and para_strip not in seen_paragraphs:
-            final_paragraphs.append(para.strip())
-            seen_paragraphs.add(para_strip)
+    seen_digests = set()
+    for chunk in repaired_chunks:
+        for para in chunk.split('\n\n'):
+            para_strip = para.strip()
+            if not para_strip:
+                continue
+            digest = hashlib.blake2b(para_strip.encode('utf-8'), digest_size=16).digest()
+            if digest not in seen_digests:
+                seen_digests.add(digest)
+                final_paragraphs.append(para_strip)
 
     return "\n\n".join(final_paragraphs)
 
@@ -154,7 +322,7 @@ def process_directory(input_dir: str, output_dir: str):
 
     os.makedirs(output_dir, exist_ok=True)
 
-    filenames = sorted([f for f in os.listdir(input_dir) if f.endswith(".txt")])
+    filenames = sorted(e.name for e in os.scandir(input_dir) if e.is_file() and e.name.endswith(".txt"))
     if not filenames:
         print(f"No .txt files found in {input_dir}")
         return
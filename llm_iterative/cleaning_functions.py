@@ -1,23 +1,83 @@
 import re
 from pathlib import Path
+# google-re2 matches in linear time with no backtracking; the citation scan uses it when installed.
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Precompiled once at import; the cleaning functions below only run .sub() on them.
+# Handles: [1], [12], [3]56-57, ［4］, etc.
+CITATION_REGEX = r'\[\d+\](?:\d+-\d+)?|［\d+］(?:\d+-\d+)?'
+if re2:
+    # Python's \d matches any Unicode decimal digit; RE2's only matches 0-9.
+    CITATION_PATTERN = re2.compile(CITATION_REGEX.replace(r'\d', r'\p{Nd}'))
+else:
+    CITATION_PATTERN = re.compile(CITATION_REGEX)
+ENGLISH_ABSTRACT_PATTERN = re.compile(r'# Insights on the psychological protection work of foreign navies.*', re.DOTALL)
+
+# Byte versions of the two patterns, so clean_fused can run on raw UTF-8 (e.g. an mmap)
+# without decoding it. Without re2, \d covers ASCII and full-width digits.
+CITATION_BYTES_REGEX = CITATION_REGEX.encode('utf-8')
+if re2:
+    CITATION_BYTES_PATTERN = re2.compile(CITATION_BYTES_REGEX.replace(rb'\d', rb'\p{Nd}'))
+else:
+    CITATION_BYTES_PATTERN = re.compile(CITATION_BYTES_REGEX.replace(rb'\d', rb'(?:[0-9]|\xef\xbc[\x90-\x99])'))
+ENGLISH_ABSTRACT_BYTES_PATTERN = re.compile(ENGLISH_ABSTRACT_PATTERN.pattern.encode('utf-8'), re.DOTALL)
+# What str.strip() removes, as UTF-8: single ASCII bytes and multi-byte sequences.
+ASCII_WHITESPACE_BYTES = frozenset(c for c in range(0x80) if chr(c).isspace())
+UTF8_WHITESPACE_SEQUENCES = tuple(chr(c).encode('utf-8') for c in range(0x80, 0x3001) if chr(c).isspace())
+
+def find_body_offsets(data, start_heading, end_heading):
+    """
+    Returns the (start, end) offsets of the body between the first start heading and the
+    first end heading after it, or None. Works on str, bytes and mmap alike.
+    """
+    # Same span as a non-greedy start(.*?)end regex search, found with two literal scans.
+    start = data.find(start_heading)
+    if start < 0:
+        return None
+    start += len(start_heading)
+    end = data.find(end_heading, start)
+    return (start, end) if end >= 0 else None
+
+def strip_offsets(data, start: int, end: int) -> tuple:
+    """
+    Returns the (start, end) offsets of data[start:end] (UTF-8 bytes or an mmap) without
+    the leading and trailing whitespace that str.strip() would remove from the decoded text.
+    """
+    while start < end:
+        if data[start] in ASCII_WHITESPACE_BYTES:
+            start += 1
+            continue
+        seq = next((s for s in UTF8_WHITESPACE_SEQUENCES if data[start:start + len(s)] == s), None)
+        if seq is None:
+            break
+        start += len(seq)
+    while start < end:
+        if data[end - 1] in ASCII_WHITESPACE_BYTES:
+            end -= 1
+            continue
+        seq = next((s for s in UTF8_WHITESPACE_SEQUENCES
+                    if end - len(s) >= start and data[end - len(s):end] == s), None)
+        if seq is None:
+            break
+        end -= len(seq)
+    return start, end
 
 def extract_body_by_headings(text: str, start_heading: str, end_heading: str) -> str:
     """
     Extracts the main body of text between a start and an end heading.
-    Uses regex to find the headings, which can be simple text.
+    The headings are matched as literal text.
     """
     print(f"  -> Running: extract_body_by_headings")
     print(f"     - Start: '{start_heading}'")
     print(f"     - End:   '{end_heading}'")
     
-    # Escape special regex characters in the user-provided headings
-    start_pattern = re.escape(start_heading)
-    end_pattern = re.escape(end_heading)
-    
-    match = re.search(f"{start_pattern}(.*?){end_pattern}", text, re.DOTALL)
-    if match:
+    span = find_body_offsets(text, start_heading, end_heading)
+    if span:
         print("     - Match found.")
-        return match.group(1).strip()
+        return text[span[0]:span[1]].strip()
     else:
         print("     - WARNING: No match found for the specified window.")
         return text
@@ -28,9 +88,7 @@ def remove_citations(text: str) -> str:
     Handles both full-width［］and standard [] brackets.
     """
     print(f"  -> Running: remove_citations")
-    # This single regex handles: [1], [12], [3]56-57, ［4］, etc.
-    pattern = r'\[\d+\](?:\d+-\d+)?|［\d+］(?:\d+-\d+)?'
-    cleaned_text = re.sub(pattern, '', text)
+    cleaned_text = CITATION_PATTERN.sub('', text)
     print("     - Citations removed.")
     return cleaned_text
 
@@ -39,11 +97,38 @@ def remove_english_abstract(text: str) -> str:
     Removes the final English abstract section.
     """
     print(f"  -> Running: remove_english_abstract")
-    pattern = r'# Insights on the psychological protection work of foreign navies.*'
-    cleaned_text = re.sub(pattern, '', text, flags=re.DOTALL)
+    cleaned_text = ENGLISH_ABSTRACT_PATTERN.sub('', text)
     print("     - English abstract removed.")
     return cleaned_text
 
+def clean_fused(text, start: int = 0, end: int = None,
+                remove_cits: bool = True, remove_abs: bool = True):
+    """
+    remove_citations and remove_english_abstract on text[start:end] in a single pass:
+    the abstract only moves the end of the window, and the text between citations is
+    collected and joined once. Works on str, or on UTF-8 bytes/mmap (returning bytes).
+    """
+    if isinstance(text, str):
+        citation_pattern, abstract_pattern, empty = CITATION_PATTERN, ENGLISH_ABSTRACT_PATTERN, ""
+    else:
+        citation_pattern, abstract_pattern, empty = CITATION_BYTES_PATTERN, ENGLISH_ABSTRACT_BYTES_PATTERN, b""
+    if end is None:
+        end = len(text)
+    if remove_abs:
+        match = abstract_pattern.search(text, start, end)
+        if match:
+            end = match.start()
+    if not remove_cits:
+        return text[start:end]
+
+    parts = []
+    pos = start
+    for match in citation_pattern.finditer(text, start, end):
+        parts.append(text[pos:match.start()])
+        pos = match.end()
+    parts.append(text[pos:end])
+    return empty.join(parts)
+
 # You can add more pre-vetted cleaning functions here in the future
 # def remove_urls(text: str) -> str:
 #     ...
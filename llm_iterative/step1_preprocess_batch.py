@@ -1,8 +1,21 @@
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from tqdm import tqdm
 import json
 
+# orjson serializes (and pretty-prints) in C and keeps non-ASCII text as-is;
+# fall back to the stdlib if it isn't installed. Both produce the same 2-space-indented JSON.
+try:
+    import orjson
+
+    def _dump_json(data) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def _dump_json(data) -> bytes:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
 # Import the universal partition function
 from unstructured.partition.auto import partition
 
@@ -13,31 +26,72 @@ from unstructured.partition.auto import partition
 SOURCE_DIRECTORY = "/Users/lukasfiller/dev/unstructured/iterative_cleaner_8sep/llm_iterative/source_files"
 # Directory where the intermediate, rule-based cleaned paragraphs will be saved
 INTERMEDIATE_DIRECTORY = "/Users/lukasfiller/dev/unstructured/iterative_cleaner_8sep/llm_iterative/cleaned_files/intermediate_json"
+# Worker processes for extraction. Each worker loads its own hi_res layout/OCR models,
+# so use half the cores to keep memory in check.
+MAX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# --- COMPILED REGEX PATTERNS ---
+
+# Elements that are headers, footers, metadata or reference entries rather than body text.
+JUNK_PATTERN = re.compile(
+    r'^(Vol\.\s*\d+|Journal\s*of|Jun\.\s*\d{4}|第\s*\d+\s*卷|武汉交通职业学院学报|Copyright|http:|www\.cnki\.net|'
+    r'摘要:|关键词:|中图分类号:|DOI:|文章编号:|开放科学|收稿日期:|作者简介:|参考文献:|'
+    r'\(责任编辑:.*\)|'
+    r'-\s*\d+\s*-|'
+    r'\[\d+\]|'
+    r'张雯:习近平总体国家安全观的思想理论渊源)',
+    re.IGNORECASE
+)
+
+# Whitespace between two Chinese characters, which PDF extraction inserts spuriously.
+# Lookarounds leave the characters unconsumed, so runs like "中 文 字" collapse fully in one pass.
+CJK_SPACE_PATTERN = re.compile(r'(?<=[\u4e00-\u9fff])\s+(?=[\u4e00-\u9fff])')
+
+# Last characters that close a paragraph. All are single characters, so a set lookup
+# on text[-1] replaces str.endswith over a tuple.
+SENTENCE_ENDERS = frozenset('。！？”.')
 
 # --- HELPER FUNCTIONS ---
 
 def find_supported_files(directory: str) -> list:
     """Finds all supported files (.pdf, .txt, .md, .docx) in a directory."""
     supported_files = []
-    supported_extensions = ['.pdf', '.md', '.txt', '.docx']
+    supported_extensions = {'.pdf', '.md', '.txt', '.docx'}
     print(f"--- Scanning for supported files in: {directory} ---")
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if not file.startswith('.') and any(file.lower().endswith(ext) for ext in supported_extensions):
-                supported_files.append(os.path.join(root, file))
+    # Walk the tree with os.scandir: DirEntry already knows its name and type,
+    # so no extra stat calls are needed. Symlinked directories are not followed, as with os.walk.
+    pending_dirs = [directory]
+    while pending_dirs:
+        with os.scandir(pending_dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                elif not entry.name.startswith('.') and os.path.splitext(entry.name)[1].lower() in supported_extensions:
+                    supported_files.append(entry.path)
     return supported_files
 
 def extract_elements(file_path: str) -> list:
     """
-    Uses the universal `partition` function to extract text elements,
-    automatically handling PDF, MD, and TXT files.
+    Extracts text elements from a file. Plain .txt files are read directly, one element
+    per non-empty line as partition() would give; everything else goes through `partition`.
     """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.txt':
+        # No layout analysis or OCR is needed for plain text.
+        try:
+            text = Path(file_path).read_text(encoding='utf-8', errors='replace')
+        except Exception as e:
+            print(f"  - ERROR: Could not read file {os.path.basename(file_path)}. Reason: {e}")
+            return None
+        return [line for line in text.splitlines() if line.strip()]
+
     print(f"\n-> Processing file with unstructured: {os.path.basename(file_path)}")
     try:
-        # This is the key change: partition() auto-detects the file type.
+        # partition() auto-detects the file type. The layout/OCR models of 'hi_res'
+        # only pay off for PDFs; .md and .docx carry their structure already.
         elements = partition(
             filename=file_path,
-            strategy="hi_res",  # 'hi_res' is great for PDFs, and harmless for TXT/MD
+            strategy="hi_res" if ext == '.pdf' else "fast",
             languages=["eng", "chi_sim"]
         )
         return [el.text for el in elements if el.text and el.text.strip()]
@@ -49,37 +103,50 @@ def reconstruct_and_polish_rules_only(elements: list) -> list:
     """
     Filters junk, then intelligently reconstructs paragraphs using rule-based logic.
     """
-    junk_patterns = re.compile(
-        r'^(Vol\.\s*\d+|Journal\s*of|Jun\.\s*\d{4}|第\s*\d+\s*卷|武汉交通职业学院学报|Copyright|http:|www\.cnki\.net|'
-        r'摘要:|关键词:|中图分类号:|DOI:|文章编号:|开放科学|收稿日期:|作者简介:|参考文献:|'
-        r'\(责任编辑:.*\)|'
-        r'-\s*\d+\s*-|'
-        r'\[\d+\]|'
-        r'张雯:习近平总体国家安全观的思想理论渊源)',
-        re.IGNORECASE
-    )
-    
-    filtered_elements = [el for el in elements if not junk_patterns.search(el.strip())]
+    filtered_elements = [el for el in elements if not JUNK_PATTERN.search(el.strip())]
 
     reconstructed_paragraphs = []
-    current_paragraph = ""
-    sentence_enders = tuple(['。', '！', '？', '”', '.'])
+    # Pieces of the paragraph being built; joined once when it ends, instead of
+    # re-copying a growing string on every element.
+    current_paragraph = []
 
     for text in filtered_elements:
-        clean_text = re.sub(r'([\u4e00-\u9fff])\s+([\u4e00-\u9fff])', r'\1\2', text).strip()
+        clean_text = CJK_SPACE_PATTERN.sub('', text).strip()
         if not clean_text:
             continue
-        current_paragraph += " " + clean_text
-        if clean_text.endswith(sentence_enders):
-            reconstructed_paragraphs.append(current_paragraph.strip())
-            current_paragraph = ""
+        current_paragraph.append(clean_text)
+        if clean_text[-1] in SENTENCE_ENDERS:
+            reconstructed_paragraphs.append(" ".join(current_paragraph))
+            current_paragraph.clear()
             
     if current_paragraph:
-        reconstructed_paragraphs.append(current_paragraph.strip())
+        reconstructed_paragraphs.append(" ".join(current_paragraph))
 
     final_paragraphs = [p for p in reconstructed_paragraphs if len(p) > 50]
     return final_paragraphs
 
+def _init_worker():
+    """Keeps each worker's OCR/layout models single-threaded so the pool doesn't oversubscribe the CPU."""
+    os.environ["OMP_NUM_THREADS"] = "1"
+
+def _preprocess_one(file_path: str) -> str:
+    """
+    Worker: extracts and reconstructs one file's paragraphs and saves them as JSON.
+    Each process loads its own copy of the unstructured models on first use.
+    Returns a status line for the progress log.
+    """
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    output_path = os.path.join(INTERMEDIATE_DIRECTORY, f"{base_name}.json")
+
+    elements = extract_elements(file_path)
+    if not elements:
+        return f"  - No content extracted from '{base_name}'. Skipping."
+
+    reconstructed_paragraphs = reconstruct_and_polish_rules_only(elements)
+
+    Path(output_path).write_bytes(_dump_json(reconstructed_paragraphs))
+    return f"  - ✅ Saved {len(reconstructed_paragraphs)} paragraphs from '{base_name}' to intermediate JSON."
+
 # --- MAIN EXECUTION ---
 def main():
     if not os.path.isdir(SOURCE_DIRECTORY):
@@ -90,27 +157,23 @@ def main():
     all_files = find_supported_files(SOURCE_DIRECTORY)
     print(f"--- Found {len(all_files)} supported files to process. ---")
 
-    for file_path in tqdm(all_files, desc="Processing all files"):
+    # Check for existing outputs up front so skipped files are never sent to a worker.
+    pending_files = []
+    for file_path in all_files:
         base_name = os.path.splitext(os.path.basename(file_path))[0]
         output_path = os.path.join(INTERMEDIATE_DIRECTORY, f"{base_name}.json")
-
         if os.path.exists(output_path):
-            tqdm.write(f"  - Skipping '{base_name}', intermediate file already exists.")
+            print(f"  - Skipping '{base_name}', intermediate file already exists.")
             continue
+        pending_files.append(file_path)
 
-        elements = extract_elements(file_path)
-        if not elements:
-            tqdm.write(f"  - No content extracted from '{base_name}'. Skipping.")
-            continue
-        
-        reconstructed_paragraphs = reconstruct_and_polish_rules_only(elements)
-
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(reconstructed_paragraphs, f, indent=2, ensure_ascii=False)
-            
-        tqdm.write(f"  - ✅ Saved {len(reconstructed_paragraphs)} paragraphs from '{base_name}' to intermediate JSON.")
+    # hi_res extraction is CPU-bound and independent per file, so fan out across cores.
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_init_worker) as executor:
+        results = executor.map(_preprocess_one, pending_files)
+        for message in tqdm(results, total=len(pending_files), desc="Processing all files"):
+            tqdm.write(message)
 
     print("\n--- Preprocessing complete for all files. ---")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
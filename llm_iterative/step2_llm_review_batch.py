@@ -1,14 +1,36 @@
 import os
-import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-import ftfy
+from ftfy import TextFixerConfig, fix_text
 import ollama
 
+# orjson is a much faster C parser; fall back to the stdlib if it isn't installed.
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.loads
+
 # --- CONFIGURATION ---
 INTERMEDIATE_DIRECTORY = "llm_iterative/cleaned_files/intermediate_json"
 FINAL_OUTPUT_DIRECTORY = "llm_iterative/cleaned_files/final_llm_polished"
 OLLAMA_REVIEW_MODEL = "llama3.1:8b-instruct-fp16"
 ENABLE_LLM_REVIEW = True
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+KEEP_ALIVE = "1h"  # Keep the model loaded between paragraphs and files.
+# In-flight review requests. Match the server's OLLAMA_NUM_PARALLEL setting.
+MAX_CONCURRENT_REQUESTS = 8
+
+# One client for the whole run, so every request reuses the same HTTP connection
+# instead of the module-level ollama.chat() helper.
+_CLIENT = ollama.Client(host=OLLAMA_HOST)
+
+# Only the ftfy fixers that matter for PDF text. The input is never HTML, and
+# fullwidth punctuation (，？！：) is intentional in Chinese text, so both are left alone.
+# Ligatures (ﬁ, ﬂ) are common in PDF extractions and stay fixed.
+_FTFY_CFG = TextFixerConfig(unescape_html=False, fix_character_width=False)
 
 # --- HELPER FUNCTION ---
 def llm_polish_and_validate(paragraph: str) -> str:
@@ -22,10 +44,11 @@ def llm_polish_and_validate(paragraph: str) -> str:
     )
     prompt = f"Please review and clean the following text:\n\n---\n\n{paragraph}"
     try:
-        response = ollama.chat(
+        response = _CLIENT.chat(
             model=OLLAMA_REVIEW_MODEL,
             messages=[{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': prompt}],
-            options={"temperature": 0.0}
+            options={"temperature": 0.0},
+            keep_alive=KEEP_ALIVE
         )
         cleaned_text = response['message']['content'].strip()
         if cleaned_text.upper() == "JUNK":
@@ -43,7 +66,8 @@ def main():
         return
 
     os.makedirs(FINAL_OUTPUT_DIRECTORY, exist_ok=True)
-    json_files = [f for f in os.listdir(INTERMEDIATE_DIRECTORY) if f.endswith('.json')]
+    fix_text("", config=_FTFY_CFG)  # Load ftfy's lookup tables once, up front.
+    json_files = [e.name for e in os.scandir(INTERMEDIATE_DIRECTORY) if e.is_file() and e.name.endswith('.json')]
     print(f"--- Found {len(json_files)} JSON files to review with LLM. ---")
 
     for json_file in tqdm(json_files, desc="Processing all JSON files"):
@@ -55,22 +79,25 @@ def main():
             tqdm.write(f"  - Skipping '{base_name}', final text file already exists.")
             continue
 
-        with open(input_path, 'r', encoding='utf-8') as f:
-            reconstructed_paragraphs = json.load(f)
+        # Read raw bytes; both parsers decode UTF-8 themselves.
+        reconstructed_paragraphs = _loads(Path(input_path).read_bytes())
         
         tqdm.write(f"\n-> Reviewing {len(reconstructed_paragraphs)} paragraphs from '{base_name}'...")
         
         if ENABLE_LLM_REVIEW:
-            llm_polished_paragraphs = []
-            for para in tqdm(reconstructed_paragraphs, desc=f"LLM Review ({base_name})", leave=False):
-                polished_para = llm_polish_and_validate(para)
-                if polished_para:
-                    llm_polished_paragraphs.append(polished_para)
+            # Paragraphs are reviewed independently, so keep several requests in flight.
+            # executor.map yields results in paragraph order.
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+                polished = list(tqdm(
+                    executor.map(llm_polish_and_validate, reconstructed_paragraphs),
+                    total=len(reconstructed_paragraphs), desc=f"LLM Review ({base_name})", leave=False
+                ))
+            llm_polished_paragraphs = [para for para in polished if para]
             final_text = "\n\n".join(llm_polished_paragraphs)
         else:
             final_text = "\n\n".join(reconstructed_paragraphs)
 
-        final_text = ftfy.fix_text(final_text)
+        final_text = fix_text(final_text, config=_FTFY_CFG)
         
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(final_text)
@@ -2,16 +2,74 @@
 
 import ollama
 import json
+# orjson is a much faster C parser; fall back to the stdlib if it isn't installed.
+# Its decode errors subclass json.JSONDecodeError, so the except clauses cover both.
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 import os
+import mmap
+import asyncio
+import hashlib
 import re
 import subprocess
 import sys
 import argparse
+import threading
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from cleaning_functions import extract_body_by_headings, remove_citations, remove_english_abstract
+from ollama import AsyncClient
+# pyahocorasick finds all heading markers in one pass over the text; without it every
+# "#" line is checked instead.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+from cleaning_functions import (
+    extract_body_by_headings, remove_citations, remove_english_abstract,
+    find_body_offsets, strip_offsets, clean_fused,
+)
 
 # --- Configuration ---
-OLLAMA_MODEL = "llama3:16k" 
+# Finding two headings is a small structured-output task, and only the head and tail of a document
+# are sent (see HEAD_CHARS), so a compact 4-bit model is enough and decodes several times faster.
+# Override with --model (e.g. the 16k-context "llama3:16k" built from Modelfile-16k).
+OLLAMA_MODEL = "qwen2.5:3b-instruct-q4_K_M"
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+# Documents analyzed at once in directory mode. Match the server's OLLAMA_NUM_PARALLEL setting.
+MAX_CONCURRENT_REQUESTS = 4
+# Only the start and end of a document are sent to the LLM: the headings it looks for are
+# near the top and bottom, and prompt length dominates the inference time.
+HEAD_CHARS = 4096
+TAIL_CHARS = 4096
+# On feedback iterations the LLM gets its previous params and this many characters of the
+# original document around each heading, instead of the whole document again.
+FEEDBACK_EXCERPT_CHARS = 512
+# On-disk cache of LLM parameters keyed by the document content (and feedback), so unchanged
+# inputs skip the LLM. Disabled with --no-cache.
+PARAMS_CACHE_DIR = Path.home() / ".cache" / "text_cleaner" / "params"
+USE_PARAMS_CACHE = True
+# Well-structured Markdown is cleaned without the LLM when its "#" headings include one of
+# these section titles (compared case-insensitively, ignoring numbering like "1 " or "一、").
+INTRO_MARKERS = {"引言", "绪论", "前言", "introduction"}
+END_MARKERS = {"参考文献", "references", "bibliography"}
+HEADING_LINE_PATTERN = re.compile(r'^#+[ \t]*(.*?)[ \t]*$', re.MULTILINE)
+SECTION_NUMBER_PATTERN = re.compile(r'^(?:\d+(?:\.\d+)*\.?|[一二三四五六七八九十]+、)\s*')
+# Input files picked up in directory mode (outputs named *_cleaned_v*.md are skipped).
+INPUT_EXTENSIONS = ('.txt', '.md')
+# Worker processes that run execute_cleaning in directory mode; the regex passes are CPU-bound.
+MAX_CLEANING_WORKERS = os.cpu_count() or 1
+
+# One client for the whole run, so every request reuses the same pooled HTTP connections.
+_CLIENT = ollama.Client(host=OLLAMA_HOST)
+# The async requests run on one event loop and AsyncClient per thread (the review prefetch has its
+# own thread). Reusing them keeps connections open between iterations, and lets the concurrent
+# directory-mode requests share one pool that the server serves OLLAMA_NUM_PARALLEL at a time.
+_THREAD_STATE = threading.local()
 
 # --- Function Library Mapping ---
 AVAILABLE_FUNCTIONS = {
@@ -20,13 +78,297 @@ AVAILABLE_FUNCTIONS = {
     "remove_english_abstract": remove_english_abstract,
 }
 
-def get_cleaning_parameters(file_content: str, feedback: str = None) -> dict:
+# System prompt for several documents in one request (see --marshal-batch).
+MARSHALED_SYSTEM_PROMPT = """
+    You are an expert data cleaning agent. You will be given several documents, each starting with a line "=== DOC i ===".
+    For each document, find the information needed to isolate its main narrative body.
+
+    Return a JSON object {"results": [{...}, {...}]} with exactly one entry per "=== DOC i ===" block, in order.
+    Each entry has the following keys:
+    - "start_heading": The exact text of the heading where the main content begins (e.g., "1 引言").
+    - "end_heading": The exact text of the heading where the references or bibliography begins (e.g., "参考文献").
+
+    Example Response for two documents:
+    {"results": [
+        {"start_heading": "# 1 引言", "end_heading": "# 参考文献"},
+        {"start_heading": "# Introduction", "end_heading": "# References"}
+    ]}
+
+    Provide ONLY the JSON object.
+    """
+
+def _build_marker_automaton():
+    """Aho-Corasick automaton over all markers in lower case."""
+    automaton = ahocorasick.Automaton()
+    for marker in INTRO_MARKERS | END_MARKERS:
+        automaton.add_word(marker.lower(), marker)
+    automaton.make_automaton()
+    return automaton
+
+MARKER_AUTOMATON = _build_marker_automaton() if ahocorasick else None
+
+def _heading_lines(text: str):
+    """
+    Yields the HEADING_LINE_PATTERN match of each "#" line that may hold a marker, in order.
+    With the automaton only lines containing a marker are visited.
+    """
+    # Titles are compared in lower case, so the automaton searches a lowered copy. Its offsets
+    # only line up with the text if lowering kept every character a single character.
+    lowered = text.lower() if MARKER_AUTOMATON is not None else None
+    if lowered is None or len(lowered) != len(text):
+        yield from HEADING_LINE_PATTERN.finditer(text)
+        return
+    last_line_start = -1
+    for end_idx, _ in MARKER_AUTOMATON.iter(lowered):
+        line_start = text.rfind('\n', 0, end_idx) + 1
+        if line_start == last_line_start:
+            continue
+        last_line_start = line_start
+        match = HEADING_LINE_PATTERN.match(text, line_start)
+        if match:
+            yield match
+
+def detect_params_deterministic(text: str):
+    """
+    Finds the start and end headings from the document's own "#" headings: the first
+    intro-like heading and the first references-like heading after it.
+    Returns None if either is missing, in which case the LLM is asked.
+    """
+    start_heading = None
+    for match in _heading_lines(text):
+        title = SECTION_NUMBER_PATTERN.sub('', match.group(1)).lower()
+        if start_heading is None:
+            if title in INTRO_MARKERS:
+                start_heading = match.group(0).strip()
+        elif title in END_MARKERS:
+            return {"start_heading": start_heading, "end_heading": match.group(0).strip()}
+    return None
+
+def truncate_for_llm(text: str) -> str:
+    """Keeps the first HEAD_CHARS and last TAIL_CHARS characters of a long document."""
+    if len(text) <= HEAD_CHARS + TAIL_CHARS:
+        return text
+    return text[:HEAD_CHARS] + "\n\n…[CONTENT OMITTED]…\n\n" + text[-TAIL_CHARS:]
+
+def heading_excerpt(text: str, params: dict) -> str:
+    """
+    Returns FEEDBACK_EXCERPT_CHARS of text around the previous start and end headings.
+    A heading that isn't in the text is replaced by the start or end of the document,
+    where the right heading would be.
+    """
+    if len(text) <= 2 * FEEDBACK_EXCERPT_CHARS:
+        return text
+    half = FEEDBACK_EXCERPT_CHARS // 2
+    pieces = []
+    for key, fallback in (("start_heading", text[:FEEDBACK_EXCERPT_CHARS]),
+                          ("end_heading", text[-FEEDBACK_EXCERPT_CHARS:])):
+        heading = params.get(key)
+        pos = text.find(heading) if heading else -1
+        pieces.append(text[max(0, pos - half):pos + half] if pos >= 0 else fallback)
+    return "\n\n…\n\n".join(pieces)
+
+def _params_cache_path(*parts: str) -> Path:
+    """Cache file for the given prompt inputs; the model name is part of the key."""
+    data = "\x00".join((OLLAMA_MODEL,) + parts).encode("utf-8")
+    return PARAMS_CACHE_DIR / f"{hashlib.sha256(data).hexdigest()}.json"
+
+def load_cached_params(*parts: str):
+    """Returns the cached params for these inputs, or None."""
+    if not USE_PARAMS_CACHE:
+        return None
+    cache_path = _params_cache_path(*parts)
+    try:
+        return _loads(cache_path.read_bytes())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def store_cached_params(params: dict, *parts: str):
+    """Saves valid params for these inputs. A failed write only costs a cache miss later."""
+    if not USE_PARAMS_CACHE or not isinstance(params, dict):
+        return
+    try:
+        PARAMS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _params_cache_path(*parts).write_text(json.dumps(params, ensure_ascii=False), encoding="utf-8")
+    except OSError as e:
+        print(f"⚠️ Warning: Could not save the parameters to the cache: {e}")
+
+def prepare_model():
+    """
+    Pulls OLLAMA_MODEL if it isn't installed yet, then loads it into memory so the
+    first real request doesn't wait for the model to load.
+    """
+    try:
+        if subprocess.run(["ollama", "show", OLLAMA_MODEL], capture_output=True).returncode != 0:
+            print(f"⬇️ Model '{OLLAMA_MODEL}' not found locally. Pulling it...")
+            subprocess.run(["ollama", "pull", OLLAMA_MODEL], check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"⚠️ Warning: Could not pull model '{OLLAMA_MODEL}': {e}")
+
+    try:
+        # A request without a prompt just loads the model.
+        _CLIENT.generate(model=OLLAMA_MODEL, prompt="")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not preload model '{OLLAMA_MODEL}': {e}")
+
+def _run_async(make_coro):
+    """Runs make_coro(client) to completion on this thread's event loop and AsyncClient."""
+    if not hasattr(_THREAD_STATE, "loop"):
+        _THREAD_STATE.loop = asyncio.new_event_loop()
+        _THREAD_STATE.client = AsyncClient(host=OLLAMA_HOST)
+    return _THREAD_STATE.loop.run_until_complete(make_coro(_THREAD_STATE.client))
+
+def get_cleaning_parameters(file_content: str, feedback: str = None, prev_params: dict = None,
+                            history: list = None) -> dict:
     """
     Step 1: LLM analyzes text to extract key parameters for cleaning functions.
     This is more reliable than asking it to generate a complex plan.
+    With feedback and prev_params, only the previous params and excerpts around
+    their headings are sent, not the whole document.
+    `history` is an optional list of the chat messages so far; the new turn is appended
+    to it, so Ollama can reuse the prompt it already processed for this document.
     """
-    print(f"🤖 Step 1: Analyzing document to extract cleaning parameters with '{OLLAMA_MODEL}'...")
-    
+    return _run_async(lambda client: _extract(client, file_content, feedback, prev_params, history))
+
+def get_cleaning_parameters_marshaled(docs: list) -> list:
+    """
+    Step 1 for several documents in a single LLM request.
+    Returns the params (or None) for each document, in order.
+    """
+    return _run_async(lambda client: _extract_marshaled(client, docs))
+
+async def get_cleaning_parameters_batch(client: AsyncClient, contents: list, marshal_batch: int = 1) -> list:
+    """
+    Step 1 for many documents at once: fires the parameter requests concurrently,
+    so the total time is roughly that of the slowest request rather than the sum.
+    With marshal_batch > 1, each request carries that many documents.
+    Returns the params (or None) for each content, in order.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def extract_one(content: str):
+        async with semaphore:
+            return await _extract(client, content)
+
+    if marshal_batch <= 1:
+        return await asyncio.gather(*(extract_one(content) for content in contents))
+
+    async def extract_group(group: list):
+        async with semaphore:
+            return await _extract_marshaled(client, group)
+
+    # Only documents whose headings can't be found deterministically are sent to the LLM.
+    params_list = [detect_params_deterministic(content) for content in contents]
+    pending = [i for i, params in enumerate(params_list) if params is None]
+    groups = [pending[i:i + marshal_batch] for i in range(0, len(pending), marshal_batch)]
+    results = await asyncio.gather(*(extract_group([contents[j] for j in group]) for group in groups))
+    for group, group_results in zip(groups, results):
+        for j, params in zip(group, group_results):
+            params_list[j] = params
+    return params_list
+
+async def _extract_marshaled(client: AsyncClient, docs: list) -> list:
+    """Asks the LLM for the cleaning parameters of several documents in one request."""
+    print(f"🤖 Step 1: Analyzing {len(docs)} documents in one request with '{OLLAMA_MODEL}'...")
+    user_prompt_content = "\n\n".join(f"=== DOC {i} ===\n{truncate_for_llm(text)}" for i, text in enumerate(docs))
+
+    raw_response_content = ""
+    try:
+        response = await client.chat(
+            model=OLLAMA_MODEL,
+            messages=[
+                {"role": "system", "content": MARSHALED_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt_content},
+            ],
+            format="json", options={"temperature": 0.0}
+        )
+        raw_response_content = response['message']['content']
+        results = _loads(raw_response_content)["results"]
+        if len(results) != len(docs):
+            print(f"⚠️ Warning: LLM returned {len(results)} results for {len(docs)} documents.")
+        # Missing or malformed entries become None, like a failed single-document request.
+        return [
+            results[i] if i < len(results) and isinstance(results[i], dict) else None
+            for i in range(len(docs))
+        ]
+    except (json.JSONDecodeError, TypeError, KeyError):
+        print("❌ Error: LLM did not return a valid JSON results array.")
+        print(f"   -> LLM Raw Response was:\n---------------------------\n{raw_response_content}\n---------------------------")
+        return [None] * len(docs)
+    except Exception as e:
+        print(f"❌ An unexpected error occurred during LLM analysis: {e}")
+        return [None] * len(docs)
+
+def find_json_object(text: str):
+    """
+    Returns the first {...} object in text, found in one pass that skips braces inside
+    JSON strings and stops at the matching '}'. Returns None if there is no '{', and the
+    rest of the text if the object never closes, so the parser reports the error.
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+async def _stream_json_object(client: AsyncClient, messages: list) -> str:
+    """
+    Streams the chat response and stops reading as soon as the top-level JSON object is
+    closed, so Ollama doesn't spend time generating trailing whitespace after it.
+    """
+    stream = await client.chat(
+        model=OLLAMA_MODEL, messages=messages,
+        format="json", options={"temperature": 0.0}, stream=True
+    )
+    content = ""
+    depth = 0
+    try:
+        async for part in stream:
+            piece = part['message']['content']
+            content += piece
+            depth += piece.count('{') - piece.count('}')
+            if depth <= 0 and '{' in content:
+                break
+    finally:
+        # Closing the stream drops the connection, which makes Ollama stop generating.
+        await stream.aclose()
+    return content
+
+async def _extract(client: AsyncClient, file_content: str, feedback: str = None, prev_params: dict = None,
+                   history: list = None) -> dict:
+    """Asks the LLM for the cleaning parameters of one document."""
+    # A rejected result always goes back to the LLM with the user's feedback.
+    if not feedback:
+        params = detect_params_deterministic(file_content)
+        if params:
+            print(f"✅ Found headings without the LLM: '{params['start_heading']}' -> '{params['end_heading']}'")
+            return params
+
+    if feedback and prev_params:
+        file_content = (
+            f"Previous params: {json.dumps(prev_params, ensure_ascii=False)}\n"
+            f"Relevant excerpt:\n{heading_excerpt(file_content, prev_params)}"
+        )
+    else:
+        file_content = truncate_for_llm(file_content)
+
     system_prompt = f"""
     You are an expert data cleaning agent. Your task is to analyze a document and extract the necessary parameters to clean it.
 
@@ -35,15 +377,11 @@ def get_cleaning_parameters(file_content: str, feedback: str = None) -> dict:
     Please provide a simple JSON object with the following keys:
     - "start_heading": The exact text of the heading where the main content begins (e.g., "1 引言").
     - "end_heading": The exact text of the heading where the references or bibliography begins (e.g., "参考文献").
-    - "has_citations": A boolean (true/false) indicating if you see citation markers like [1] or [2]34-56.
-    - "has_english_abstract": A boolean (true/false) indicating if you see an English abstract at the end.
 
     Example Response:
     {{
         "start_heading": "# 1 引言",
-        "end_heading": "# 参考文献",
-        "has_citations": true,
-        "has_english_abstract": true
+        "end_heading": "# 参考文献"
     }}
 
     Analyze the following text and provide ONLY the JSON object.
@@ -54,30 +392,38 @@ def get_cleaning_parameters(file_content: str, feedback: str = None) -> dict:
         print(f"   -> Incorporating user feedback: '{feedback}'")
         user_prompt_content = (
             f"The previous attempt was incorrect. User feedback: '{feedback}'.\n\n"
-            f"Please create a new, improved JSON parameter object based on this feedback and the content below:\n\n---\n\n{file_content}"
+            f"Please create a new, improved JSON parameter object based on this feedback and the content below"
+            f"{' (the previous params and the document around their headings)' if prev_params else ''}:\n\n---\n\n{file_content}"
         )
     
+    # Continuing the conversation keeps the earlier messages as an identical prefix,
+    # which the server's KV cache already holds, so only the new turn is prefilled.
+    messages = (history or [{"role": "system", "content": system_prompt}]) + [
+        {"role": "user", "content": user_prompt_content},
+    ]
+
+    cached = load_cached_params(file_content, feedback or "")
+    if cached is not None:
+        print("✅ Reusing cached cleaning parameters for unchanged content.")
+        # Record the turn as if the LLM had answered, so later feedback rounds send the full conversation.
+        if history is not None:
+            history[:] = messages + [{"role": "assistant", "content": json.dumps(cached, ensure_ascii=False)}]
+        return cached
+
+    print(f"🤖 Step 1: Analyzing document to extract cleaning parameters with '{OLLAMA_MODEL}'...")
+
     raw_response_content = ""
     try:
-        response = ollama.chat(
-            model=OLLAMA_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt_content},
-            ],
-            format="json", options={"temperature": 0.0}
-        )
-        raw_response_content = response['message']['content']
+        raw_response_content = await _stream_json_object(client, messages)
+        if history is not None:
+            history[:] = messages + [{"role": "assistant", "content": raw_response_content}]
         
         # Robust JSON parsing
-        json_start_index = raw_response_content.find('{')
-        if json_start_index != -1:
-            json_string = raw_response_content[json_start_index:]
-            params = json.loads(json_string)
-        else:
-            params = None
+        json_string = find_json_object(raw_response_content)
+        params = _loads(json_string) if json_string is not None else None
 
         print("✅ LLM Parameter Extraction Complete.")
+        store_cached_params(params, file_content, feedback or "")
         return params
     except (json.JSONDecodeError, TypeError, IndexError):
         print("❌ Error: LLM did not return a valid JSON object.")
@@ -87,67 +433,167 @@ def get_cleaning_parameters(file_content: str, feedback: str = None) -> dict:
         print(f"❌ An unexpected error occurred during LLM analysis: {e}")
         return None
 
-def execute_cleaning(params: dict, input_file: str, output_file: str):
+def write_atomic(path: str, data: bytes):
+    """Writes to a temporary file and renames it over `path`, so a crash never leaves half a file."""
+    tmp_path = f"{path}.tmp"
+    Path(tmp_path).write_bytes(data)
+    os.replace(tmp_path, path)
+
+def execute_cleaning(params: dict, input_file: str, output_file: str) -> bool:
     """
     Step 2 & 3: Python uses the LLM's parameters to execute a cleaning plan.
+    Citations and the English abstract are always removed where their patterns match, not asked of the LLM.
+    Returns True if output_file was written, False if cleaning changed nothing (or failed).
     """
     print(f"🚀 Step 2 & 3: Executing cleaning plan based on LLM parameters...")
     
     try:
-        text = Path(input_file).read_text(encoding="utf-8")
-        
-        # 1. Extract main body
-        start = params.get("start_heading")
-        end = params.get("end_heading")
-        if start and end:
-            text = extract_body_by_headings(text, start_heading=start, end_heading=end)
-        else:
-            print("   -> WARNING: Start or end heading not found in LLM params. Skipping body extraction.")
+        # An empty file can't be mapped, and there is nothing in it to clean.
+        if os.path.getsize(input_file) == 0:
+            write_atomic(output_file, b"")
+            print(f"✅ Plan executed. The input is empty; saved an empty file to '{output_file}'")
+            return True
 
-        # 2. Remove citations if detected
-        if params.get("has_citations", False):
-            text = remove_citations(text)
-        
-        # 3. Remove English abstract if detected
-        if params.get("has_english_abstract", False):
-            text = remove_english_abstract(text)
+        # The file is mapped rather than read, and the body is cleaned as UTF-8 bytes:
+        # nothing is ever decoded into a string.
+        with open(input_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            input_digest = hashlib.blake2b(mm, digest_size=16).digest()
+
+            # 1. Extract main body
+            start = params.get("start_heading")
+            end = params.get("end_heading")
+            span = None
+            if start and end:
+                print(f"  -> Extracting body between '{start}' and '{end}'")
+                # UTF-8 is self-synchronizing, so a byte match is always a match of whole characters.
+                span = find_body_offsets(mm, start.encode("utf-8"), end.encode("utf-8"))
+                if not span:
+                    print("     - WARNING: No match found for the specified window.")
+            else:
+                print("   -> WARNING: Start or end heading not found in LLM params. Skipping body extraction.")
+            start, end = span if span else (0, len(mm))
+            data = mm
+            if mm.find(b"\r", start, end) >= 0:
+                # Match the newline translation of reading the file in text mode.
+                data = mm[start:end].replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+                start, end = 0, len(data)
+            if span:
+                start, end = strip_offsets(data, start, end)
 
-        Path(output_file).write_text(text, encoding="utf-8")
+            # 2 & 3. Remove citations and, if detected, the English abstract in one pass over the body
+            print("  -> Removing citations and the English abstract")
+            encoded = clean_fused(data, start, end)
+
+        if hashlib.blake2b(encoded, digest_size=16).digest() == input_digest:
+            print(f"ℹ️ Plan executed, but the text is unchanged. Skipped writing '{output_file}'.")
+            return False
+        write_atomic(output_file, encoded)
         print(f"✅ Plan executed. Cleaned file saved to '{output_file}'")
+        return True
 
     except Exception as e:
         print(f"❌ An error occurred during plan execution: {e}")
+        return False
 
-def main():
+def find_input_files(input_dir: Path) -> list:
+    """Lists the documents to clean in a directory, skipping earlier cleaned outputs."""
+    return sorted(
+        path for path in input_dir.iterdir()
+        if path.is_file() and path.suffix in INPUT_EXTENSIONS and "_cleaned_v" not in path.stem
+    )
+
+def _execute_cleaning_logged(params: dict, input_file: str, output_file: str) -> str:
+    """Worker: runs execute_cleaning and returns what it printed, so logs don't interleave."""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        execute_cleaning(params, input_file, output_file)
+    return log.getvalue()
+
+def clean_directory(input_dir: Path, marshal_batch: int = 1):
     """
-    Orchestrates the entire iterative cleaning process.
+    Cleans every document in a directory in one non-interactive pass: the LLM parameters
+    for all files are requested concurrently, then each file is cleaned to *_cleaned_v1.md.
     """
-    parser = argparse.ArgumentParser(description="Iterative document cleaning with LLM feedback")
-    parser.add_argument("input_file", nargs='?', default="Zhang_2022_zh.txt", 
-                       help="Path to the input file to clean")
-    
-    args = parser.parse_args()
-    input_file = Path(args.input_file)
-    
-    if not input_file.exists():
-        print(f"❌ Input file not found: {input_file}")
+    input_files = find_input_files(input_dir)
+    if not input_files:
+        print(f"❌ No {'/'.join(INPUT_EXTENSIONS)} files found in {input_dir}")
+        return
+
+    print(f"--- Found {len(input_files)} files. Extracting cleaning parameters concurrently... ---")
+    contents = [path.read_text(encoding="utf-8") for path in input_files]
+    params_list = _run_async(lambda client: get_cleaning_parameters_batch(client, contents, marshal_batch))
+
+    jobs = []
+    for input_file, params in zip(input_files, params_list):
+        if not params or not isinstance(params, dict):
+            print(f"\n--- {input_file.name} ---")
+            print("🛑 No valid cleaning parameters proposed by LLM. Skipping.")
+            continue
+        cleaned_file = input_file.with_name(f"{input_file.stem}_cleaned_v1.md")
+        jobs.append((params, str(input_file), str(cleaned_file)))
+
+    # Each file is cleaned independently, so fan the regex work out across cores.
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(len(jobs), MAX_CLEANING_WORKERS)) as executor:
+            logs = executor.map(_execute_cleaning_logged, *zip(*jobs))
+            for (_, input_file, _), log in zip(jobs, logs):
+                print(f"\n--- {Path(input_file).name} ---")
+                print(log, end="")
+
+    print(f"\n🎉 Batch cleaning complete. Review the *_cleaned_v1.md files in {input_dir}")
+
+def review_directory(input_dir: Path):
+    """
+    Runs the interactive review loop for each document in a directory. While one file is
+    being reviewed, the LLM parameters for the next file are fetched in the background.
+    """
+    input_files = find_input_files(input_dir)
+    if not input_files:
+        print(f"❌ No {'/'.join(INPUT_EXTENSIONS)} files found in {input_dir}")
         return
 
-    current_file_to_clean = input_file
+    def fetch_params(path: Path):
+        history = []
+        return get_cleaning_parameters(path.read_text(encoding="utf-8"), history=history), history
+
+    # Two workers, so the next file's request can start while the current one is still running.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        prefetched = {input_files[0]: executor.submit(fetch_params, input_files[0])}
+        for i, input_file in enumerate(input_files):
+            print(f"\n=== Reviewing {input_file.name} ({i + 1}/{len(input_files)}) ===")
+            if i + 1 < len(input_files):
+                next_file = input_files[i + 1]
+                prefetched[next_file] = executor.submit(fetch_params, next_file)
+            clean_interactively(input_file, prefetched.pop(input_file))
+
+    print(f"\n🎉 Reviewed all {len(input_files)} files in {input_dir}")
+
+def clean_interactively(input_file: Path, prefetched=None):
+    """
+    Cleans one file, asking the user to approve each version and feeding their hints back
+    to the LLM in the same chat. `prefetched` is an optional Future holding the first
+    iteration's (params, history). Every iteration cleans the original file with the latest params.
+    """
     iteration = 1
     feedback = None 
+    # The params and file of the version the user last saw.
+    last_params = last_version = None
+    history = []
+
+    try:
+        content = input_file.read_text(encoding="utf-8")
+    except Exception as e:
+        print(f"❌ Could not read file {input_file}: {e}")
+        return
     
     while True:
         print(f"\n--- Starting Cleaning Iteration {iteration} ---")
-        cleaned_file = current_file_to_clean.with_name(f"{input_file.stem}_cleaned_v{iteration}.md")
+        cleaned_file = input_file.with_name(f"{input_file.stem}_cleaned_v{iteration}.md")
 
-        try:
-            content = current_file_to_clean.read_text(encoding="utf-8")
-        except Exception as e:
-            print(f"❌ Could not read file {current_file_to_clean}: {e}")
-            break
-
-        params = get_cleaning_parameters(content, feedback=feedback)
+        if prefetched is not None:
+            (params, history), prefetched = prefetched.result(), None
+        else:
+            params = get_cleaning_parameters(content, feedback=feedback, prev_params=last_params, history=history)
         
         if not params or not isinstance(params, dict):
             print("🛑 No valid cleaning parameters proposed by LLM. Stopping.")
@@ -155,7 +601,13 @@ def main():
             print("Final proposed params:", params)
             break
             
-        execute_cleaning(params, str(current_file_to_clean), str(cleaned_file))
+        if last_params and all(params.get(k) == last_params.get(k) for k in ("start_heading", "end_heading")):
+            print("ℹ️ The LLM proposed the same headings again, so the result is unchanged.")
+            cleaned_file = last_version
+        elif not execute_cleaning(params, str(input_file), str(cleaned_file)):
+            # Nothing was written; the original file is this version.
+            cleaned_file = input_file
+        last_params, last_version = params, cleaned_file
         
         print(f"🧐 Step 4: Please inspect the cleaned file: {cleaned_file}")
         
@@ -171,8 +623,56 @@ def main():
         else:
             print("   -> Not approved.")
             feedback = input("   -> Please provide a hint for the next attempt: ")
-            current_file_to_clean = cleaned_file
             iteration += 1
 
+def main():
+    """
+    Orchestrates the entire iterative cleaning process.
+    """
+    global USE_PARAMS_CACHE, OLLAMA_MODEL
+    parser = argparse.ArgumentParser(
+        description="Iterative document cleaning with LLM feedback",
+        epilog=(
+            "When INPUT_FILE is a directory, requests run concurrently. The Ollama server decides "
+            "how many it serves in parallel: set OLLAMA_NUM_PARALLEL (parallel requests per model) "
+            "and OLLAMA_MAX_LOADED_MODELS (models kept in memory) before starting 'ollama serve'."
+        )
+    )
+    parser.add_argument("input_file", nargs='?', default="Zhang_2022_zh.txt", 
+                       help="Path to the input file to clean, or a directory to clean all its .txt/.md files")
+    parser.add_argument("--model", default=OLLAMA_MODEL,
+                       help=f"Ollama model used to find the headings (default: {OLLAMA_MODEL}).")
+    parser.add_argument("--marshal-batch", type=int, default=1, metavar="K",
+                       help="Directory mode: send K documents per LLM request (default: 1). "
+                            "Larger K amortizes the prompt overhead, but latency grows quickly past a few documents.")
+    
+    parser.add_argument("--review", action="store_true",
+                       help="Directory mode: review each file interactively, as for a single file, "
+                            "while the next file's parameters are fetched in the background.")
+    
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Always ask the LLM, ignoring cached parameters.")
+    
+    args = parser.parse_args()
+    input_file = Path(args.input_file)
+
+    USE_PARAMS_CACHE = not args.no_cache
+    OLLAMA_MODEL = args.model
+    
+    if not input_file.exists():
+        print(f"❌ Input file not found: {input_file}")
+        return
+
+    prepare_model()
+
+    if input_file.is_dir():
+        if args.review:
+            review_directory(input_file)
+        else:
+            clean_directory(input_file, args.marshal_batch)
+        return
+
+    clean_interactively(input_file)
+
 if __name__ == "__main__":
     main()